@@ -13,12 +13,45 @@ euserv 自動續期腳本
 
 import os
 import re
+import sys
 import json
 import time
+import random
+import hashlib
+import io
+import socket
+import struct
+import argparse
+import subprocess
+import ipaddress
+import socketserver
+import multiprocessing
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import ast
+import html
 import base64
+import codecs
+import threading
+from collections import deque
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from html.parser import HTMLParser
+from email.utils import getaddresses
+from urllib.parse import urlsplit
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
 from bs4 import BeautifulSoup
-import ddddocr
+
+from http_trace import trace_session
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # 驗證碼預處理為可選功能，缺少依賴時直接使用原圖
+    np = None
+    Image = None
 
 # 環境變數
 USERNAME = os.getenv('EUSERV_USERNAME', '').encode().decode('utf-8', errors='replace')
@@ -26,16 +59,118 @@ PASSWORD = os.getenv('EUSERV_PASSWORD', '').encode().decode('utf-8', errors='rep
 OCR_SPACE_API_KEY = os.getenv('OCR_SPACE_API_KEY', '').encode().decode('utf-8', errors='replace')
 MAILPARSER_DOWNLOAD_URL_ID = os.getenv('MAILPARSER_DOWNLOAD_URL_ID', '').encode().decode('utf-8', errors='replace')
 MAILPARSER_DOWNLOAD_BASE_URL = "https://files.mailparser.io/d/"
+# 多個賬號共用一個 mailparser 收件箱時，按解析出的收件人字段和時間字段把 PIN 分配給對應賬號
+MAILPARSER_RECEIVER_FIELD = os.getenv('MAILPARSER_RECEIVER_FIELD', 'receiver')
+MAILPARSER_TIME_FIELD = os.getenv('MAILPARSER_TIME_FIELD', 'received_at')
+# 郵件時間與本機時鐘允許的偏差（秒）
+MAILPARSER_CLOCK_SKEW = 120
 TG_BOT_TOKEN = os.getenv('TG_BOT_TOKEN', '').encode().decode('utf-8', errors='replace')
 TG_USER_ID = os.getenv('TG_USER_ID', '').encode().decode('utf-8', errors='replace')
 TG_API_HOST = "https://api.telegram.org"
+# 可選的 TrueCaptcha 憑證 https://apitruecaptcha.org/api
+TRUECAPTCHA_USERID = os.getenv('TRUECAPTCHA_USERID', '').encode().decode('utf-8', errors='replace')
+TRUECAPTCHA_APIKEY = os.getenv('TRUECAPTCHA_APIKEY', '').encode().decode('utf-8', errors='replace')
 
 # 最大登錄重試次數
 LOGIN_MAX_RETRY_COUNT = 10
+# EUserv 登錄頁在賬號或密碼錯誤時顯示的提示；只有出現該提示才確定為憑據錯誤
+LOGIN_REJECTED_TEXT = os.getenv('LOGIN_REJECTED_TEXT', 'Please check email address/customer ID and password')
+# 登錄預檢：續期前並發檢查所有賬號能否登錄，排除賬號或密碼錯誤的賬號；以及同時檢查的賬號數
+PREFLIGHT = os.getenv('PREFLIGHT', '1') != '0'
+PREFLIGHT_CONCURRENCY = int(os.getenv('PREFLIGHT_CONCURRENCY', '4'))
 # 接收 PIN 的等待時間（秒）
 WAITING_TIME_OF_PIN = 30
 # 驗證碼識別最大嘗試次數
 CAPTCHA_MAX_RETRY_COUNT = 3
+# 是否在識別前對驗證碼圖片進行預處理（灰度、二值化、去干擾線、裁剪）；默認關閉，去干擾線會擦除細筆畫
+CAPTCHA_PREPROCESS = os.getenv('CAPTCHA_PREPROCESS', '0') == '1'
+# 裁剪字形邊界框時保留的邊距（像素）
+CAPTCHA_CROP_PADDING = 4
+# 每個引擎保留的候選識別結果數量，以及驗證失敗後不重新識別、直接嘗試的備選答案數量
+CAPTCHA_TOP_K = int(os.getenv('CAPTCHA_TOP_K', '5'))
+CAPTCHA_ALTERNATIVE_TRIES = int(os.getenv('CAPTCHA_ALTERNATIVE_TRIES', '2'))
+# securimage 默認字符集和長度，用於給候選結果打分；不區分大小寫
+CAPTCHA_ALPHABET = os.getenv('CAPTCHA_ALPHABET', 'ABCDEFGHKLMNPRSTUVWYZabcdefghklmnprstuvwyz23456789')
+CAPTCHA_LENGTH = int(os.getenv('CAPTCHA_LENGTH', '6'))
+# 驗證碼樣本目錄：登錄時保存驗證碼原圖，按是否通過驗證存入 passed/ 和 failed/，供 train_captcha.py 訓練
+CAPTCHA_HARVEST_DIR = os.getenv('CAPTCHA_HARVEST_DIR', '')
+# train_captcha.py 導出的 ONNX 模型，設置後作為 custom 引擎參與識別
+CAPTCHA_MODEL_PATH = os.getenv('CAPTCHA_MODEL_PATH', '')
+# 啟動預熱：登錄請求進行的同時在後台加載 OCR 模型、預先建立外部服務的連接
+STARTUP_PREWARM = os.getenv('STARTUP_PREWARM', '1') != '0'
+# 驗證碼引擎排序：adaptive 按歷史成功率和延遲自適應選擇，fixed 固定為 custom、OCR.space、TrueCaptcha、ddddocr
+CAPTCHA_ENGINE_SELECTION = os.getenv('CAPTCHA_ENGINE_SELECTION', 'adaptive')
+# 推測性驗證碼識別：off 在出現驗證碼提示後才下載識別；prefetch 在提交賬號密碼的同時下載並識別；
+# inline 先識別再把答案隨賬號密碼一起提交（與 euserv1.py 相同），需要驗證碼時少一次往返；
+# 推測模式在不需要驗證碼的登錄上也會消耗一次識別，默認關閉
+CAPTCHA_SPECULATIVE = os.getenv('CAPTCHA_SPECULATIVE', 'off')
+# 驗證碼驗證失敗的額外代價（秒，約等於一次重新登錄），以及歷史統計的衰減係數
+CAPTCHA_FAILURE_COST = 10.0
+CAPTCHA_STATS_DECAY = 0.98
+# 熔斷器：統計窗口內的失敗率達到閾值即熔斷，冷卻後放行一次探測請求
+CIRCUIT_FAILURE_RATE = float(os.getenv('CIRCUIT_FAILURE_RATE', '0.5'))
+CIRCUIT_MIN_CALLS = int(os.getenv('CIRCUIT_MIN_CALLS', '5'))
+CIRCUIT_WINDOW = int(os.getenv('CIRCUIT_WINDOW', '10'))
+CIRCUIT_COOLDOWN = float(os.getenv('CIRCUIT_COOLDOWN', '120'))
+# ddddocr 運行位置：inline 在主進程內；process 使用子進程；daemon 使用本機 Unix socket 守護進程
+OCR_WORKER = os.getenv('OCR_WORKER', 'inline')
+OCR_WORKER_SOCKET = os.getenv('OCR_WORKER_SOCKET', '/tmp/euserv-ocr.sock')
+# 工作進程的內存上限（MB）和空閒退出時間（秒），0 表示不限制
+OCR_WORKER_MEMORY_MB = int(os.getenv('OCR_WORKER_MEMORY_MB', '0'))
+OCR_WORKER_IDLE_TIMEOUT = float(os.getenv('OCR_WORKER_IDLE_TIMEOUT', '600'))
+# ONNX 推理的 CPU 預算（線程數，0 為 CPU 核數）和同時進行的推理數上限，預算在並發推理間平分
+OCR_CPU_BUDGET = int(os.getenv('OCR_CPU_BUDGET', '0')) or os.cpu_count() or 1
+OCR_MAX_CONCURRENCY = max(int(os.getenv('OCR_MAX_CONCURRENCY', '1')), 1)
+# 每次推理的算子內/算子間線程數（0 為按預算自動分配），OCR_WORKER_THREADS 為舊名稱
+OCR_INTRA_OP_THREADS = int(os.getenv('OCR_INTRA_OP_THREADS', os.getenv('OCR_WORKER_THREADS', '0')))
+OCR_INTER_OP_THREADS = int(os.getenv('OCR_INTER_OP_THREADS', '1'))
+# 圖優化級別：disable、basic、extended、all
+OCR_GRAPH_OPTIMIZATION = os.getenv('OCR_GRAPH_OPTIMIZATION', 'all')
+# 量化模型：留空使用原模型；auto 在 STATE_DIR 中生成 int8 動態量化模型（需要 onnx）；或指定模型文件路徑
+OCR_QUANTIZED_MODEL = os.getenv('OCR_QUANTIZED_MODEL', '')
+# 等待守護進程啟動並加載模型的最長時間（秒）
+OCR_DAEMON_START_TIMEOUT = 60
+# 控制面板中訂單表格所在容器的 id
+ORDERS_CONTAINER_ID = "kc2_order_customer_orders_tab_content_1"
+# 流式讀取控制面板頁面的塊大小（位元組）
+PAGE_CHUNK_SIZE = 8192
+# 出口池：空格分隔的代理（http://、socks5h:// 等）或本機源地址（可帶 src: 前綴，支持 IPv6），
+# 每個賬號固定分配一個健康的出口，該賬號的會話只通過這個出口發出請求
+EGRESS_POOL = os.getenv('EGRESS_POOL', '').split()
+# 出口健康檢查地址、超時（秒）以及可接受的最大延遲（秒）
+EGRESS_CHECK_URL = "https://support.euserv.com/pic/logo_small.png"
+EGRESS_CHECK_TIMEOUT = 10
+EGRESS_MAX_LATENCY = float(os.getenv('EGRESS_MAX_LATENCY', '5'))
+# 連續連接失敗多少次後視為出口失效
+EGRESS_MAX_FAILURES = 2
+# 運行狀態目錄，保存續期斷點等跨運行的數據
+STATE_DIR = os.getenv('STATE_DIR', '.euserv_state')
+# 續期斷點的有效期（秒），超過後會話和 PIN 多半已失效，直接丟棄
+RENEW_CHECKPOINT_TTL = float(os.getenv('RENEW_CHECKPOINT_TTL', '3600'))
+# 賬號租約：skip 跳過其他運行正在處理的賬號，wait 等它處理完再處理，off 不使用租約
+ACCOUNT_LEASE = os.getenv('ACCOUNT_LEASE', 'skip')
+# 租約有效期（秒），持有者每隔三分之一有效期續約一次；進程崩潰後租約最多保留這麼久
+ACCOUNT_LEASE_TTL = float(os.getenv('ACCOUNT_LEASE_TTL', '120'))
+# wait 模式下最多等待的時間（秒）和檢查間隔（秒）
+ACCOUNT_LEASE_WAIT = float(os.getenv('ACCOUNT_LEASE_WAIT', '900'))
+ACCOUNT_LEASE_POLL = 10
+# 是否在 Telegram 上實時更新運行進度（編輯同一條消息），以及兩次編輯的最短間隔（秒）
+TG_PROGRESS = os.getenv('TG_PROGRESS', '1') != '0'
+TG_PROGRESS_INTERVAL = float(os.getenv('TG_PROGRESS_INTERVAL', '10'))
+# 機器人模式（--bot）getUpdates 長輪詢的超時（秒）
+TG_BOT_POLL_TIMEOUT = int(os.getenv('TG_BOT_POLL_TIMEOUT', '50'))
+# 整次運行和單個賬號的時間預算（秒），0 表示不限制
+RUN_TIME_BUDGET = float(os.getenv('RUN_TIME_BUDGET', '0'))
+ACCOUNT_TIME_BUDGET = float(os.getenv('ACCOUNT_TIME_BUDGET', '0'))
+# 賬號處理順序：priority 按訂單的緊急程度排序，預算不足時推遲可以等到下次運行的賬號；ordered 按配置順序
+SCHEDULE = os.getenv('SCHEDULE', 'priority')
+# 合同結束日期距今超過該天數的訂單可以安全推遲到下次運行
+SCHEDULE_SAFE_DAYS = int(os.getenv('SCHEDULE_SAFE_DAYS', '3'))
+# 沒有歷史耗時的賬號預計的處理時間（秒），以及耗時移動平均的權重
+SCHEDULE_DEFAULT_DURATION = 180.0
+SCHEDULE_DURATION_WEIGHT = 0.3
+# 從運行預算中預留給最終報告推送的時間（秒）
+REPORT_RESERVE_TIME = 15
 
 user_agent = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
@@ -59,6 +194,11 @@ def log(info: str):
         "登錄嘗試": "🔑",
         "[MailParser]": "📧",
         "[Captcha Solver]": "🧩",
+        "[Circuit Breaker]": "🔌",
+        "[Egress]": "🛰️",
+        "時間預算": "⏱️",
+        "[Bot]": "🤖",
+        "[Lease]": "🔒",
         "[AutoEUServerless]": "🌐",
     }
     info = info.encode('utf-8', errors='replace').decode('utf-8')
@@ -70,6 +210,249 @@ def log(info: str):
     global desp
     desp += info + "\n\n"
 
+class Clock:
+    """等待和時間預算使用的時鐘：monotonic() 用於截止時間和冷卻，time() 用於寫入磁盤的時間戳。
+    網絡延遲的測量和等待外部進程的循環仍使用真實時間"""
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+class SimulatedClock(Clock):
+    """模擬時鐘：sleep() 立即返回並把時間向前推進，包含長時間等待的流程可以在毫秒內跑完。
+    多個線程同時 sleep 時時間會累加，適合按順序執行的流程"""
+
+    def __init__(self, start: float = 0.0, epoch: float = 1700000000.0):
+        self._now = start
+        self._epoch = epoch
+        self._lock = threading.Lock()
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        with self._lock:
+            return self._now
+
+    def time(self) -> float:
+        with self._lock:
+            return self._epoch + self._now
+
+    def sleep(self, seconds: float):
+        with self._lock:
+            self.sleeps.append(seconds)
+            self._now += max(seconds, 0)
+
+    def advance(self, seconds: float):
+        with self._lock:
+            self._now += seconds
+
+clock = Clock()
+
+def set_clock(new_clock: Clock) -> Clock:
+    """替換全局時鐘並返回原來的時鐘"""
+    global clock
+    previous, clock = clock, new_clock
+    return previous
+
+_session_factory = requests.Session
+
+def create_session() -> requests.Session:
+    """創建 HTTP 會話；賬號會話、出口檢查和各外部服務的請求都經過這裡"""
+    return _session_factory()
+
+def set_session_factory(factory) -> object:
+    """替換創建會話的工廠（例如返回掛載本地替身或 replay_session 的會話），返回原來的工廠。
+    已創建的外部服務會話會被丟棄，下次請求時用新工廠重新創建"""
+    global _session_factory
+    previous, _session_factory = _session_factory, factory
+    for breaker in BREAKERS.values():
+        breaker.reset_session()
+    return previous
+
+class DeadlineExceeded(BaseException):
+    """時間預算耗盡。繼承 BaseException，以免被各處的 except Exception 吞掉而繼續重試"""
+
+class Deadline:
+    def __init__(self, budget: float = 0, parent: "Deadline" = None):
+        self.expires_at = clock.monotonic() + budget if budget > 0 else None
+        if parent is not None and parent.expires_at is not None:
+            if self.expires_at is None or parent.expires_at < self.expires_at:
+                self.expires_at = parent.expires_at
+
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+        return self.expires_at - clock.monotonic()
+
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def timeout(self, default: float) -> float:
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        if remaining <= 0:
+            raise DeadlineExceeded("時間預算已耗盡")
+        return min(default, remaining)
+
+    def sleep(self, seconds: float):
+        remaining = self.remaining()
+        if remaining is not None and remaining <= seconds:
+            clock.sleep(max(remaining, 0))
+            raise DeadlineExceeded("時間預算已耗盡")
+        clock.sleep(seconds)
+
+_deadline_local = threading.local()
+
+def current_deadline() -> Deadline:
+    return getattr(_deadline_local, "deadline", None) or Deadline()
+
+class deadline_scope:
+    """在當前線程內設置生效的 Deadline，供 call_timeout() 和 wait() 使用"""
+
+    def __init__(self, deadline: Deadline):
+        self.deadline = deadline
+
+    def __enter__(self) -> Deadline:
+        self._previous = getattr(_deadline_local, "deadline", None)
+        _deadline_local.deadline = self.deadline
+        return self.deadline
+
+    def __exit__(self, *exc):
+        _deadline_local.deadline = self._previous
+        return False
+
+def with_deadline(func, deadline: Optional[Deadline] = None):
+    """包裝 func，使其在其他線程中運行時仍受當前線程的 Deadline 約束"""
+    deadline = deadline or current_deadline()
+
+    def run(*args, **kwargs):
+        with deadline_scope(deadline):
+            return func(*args, **kwargs)
+
+    return run
+
+def call_timeout(default: float) -> float:
+    """按剩餘預算收縮的請求超時"""
+    return current_deadline().timeout(default)
+
+def wait(seconds: float):
+    """按剩餘預算收縮的等待，預算不足時拋出 DeadlineExceeded"""
+    current_deadline().sleep(seconds)
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """外部服務熔斷器，狀態為 closed、open 和 half_open"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_rate: float = CIRCUIT_FAILURE_RATE,
+                 min_calls: int = CIRCUIT_MIN_CALLS, window: int = CIRCUIT_WINDOW,
+                 cooldown: float = CIRCUIT_COOLDOWN):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._results = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._session = None
+
+    @property
+    def session(self) -> requests.Session:
+        # 同一服務的請求復用連接池；首次使用時創建，以便測試先替換會話工廠。
+        # 外部服務的請求也記錄到 HTTP 追蹤中，回放時才能越過 PIN 獲取等步驟
+        if self._session is None:
+            self._session = trace_session(create_session())
+        return self._session
+
+    def reset_session(self):
+        self._session = None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and clock.monotonic() - self._opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            recovered = self.state == self.HALF_OPEN
+            if recovered:
+                self._results.clear()
+            self.state = self.CLOSED
+            self._probing = False
+            self._results.append(True)
+        # 日誌在釋放鎖之後寫入，避免持鎖時阻塞其他線程的請求
+        if recovered:
+            log(f"[Circuit Breaker] {self.name} 探測成功，恢復服務")
+
+    def record_failure(self):
+        with self._lock:
+            self._results.append(False)
+            failures = self._results.count(False)
+            tripped = False
+            if self.state == self.HALF_OPEN or (
+                len(self._results) >= self.min_calls
+                and failures / len(self._results) >= self.failure_rate
+            ):
+                tripped = self.state != self.OPEN
+                self.state = self.OPEN
+                self._opened_at = clock.monotonic()
+                self._probing = False
+        if tripped:
+            log(f"[Circuit Breaker] {self.name} 已熔斷，{self.cooldown:.0f} 秒內直接跳過")
+
+    def release_probe(self):
+        with self._lock:
+            self._probing = False
+
+    def request(self, method: str, url: str, session=None, **kwargs) -> requests.Response:
+        """經熔斷器發送請求；連接錯誤、超時、429 和 5xx 計為失敗"""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} 熔斷中")
+        recorded = False
+        try:
+            try:
+                response = (session or self.session).request(method, url, **kwargs)
+            except requests.RequestException:
+                recorded = True
+                self.record_failure()
+                raise
+            recorded = True
+            if response.status_code == 429 or response.status_code >= 500:
+                self.record_failure()
+            else:
+                self.record_success()
+            return response
+        finally:
+            if not recorded:
+                # 超出時間預算等其他異常不計入統計，但要交還半開狀態的探測名額，否則熔斷器永遠不會恢復
+                self.release_probe()
+
+# 進度消息的編輯和機器人模式的長輪詢使用單獨的熔斷器，被限流或超時時不會影響報告和回覆的推送
+BREAKERS = {
+    name: CircuitBreaker(name)
+    for name in ("OCR.space", "TrueCaptcha", "Mailparser", "Telegram", "Telegram progress", "Telegram updates")
+}
+
 def login_retry(*args, **kwargs):
     def wrapper(func):
         def inner(username, password):
@@ -81,6 +464,9 @@ def login_retry(*args, **kwargs):
                     number += 1
                     if number > 1:
                         log(f"[AutoEUServerless] 登錄嘗試第 {number} 次")
+                    if username in rejected_credentials:
+                        # 賬號或密碼錯誤，重試只會浪費驗證碼識別
+                        return ret, ret_session
                     sess_id, session = func(username, password)
                     if sess_id != "-1":
                         return sess_id, session
@@ -90,8 +476,536 @@ def login_retry(*args, **kwargs):
         return inner
     return wrapper
 
-def captcha_solver(captcha_image_url: str, session: requests.Session) -> dict:
-    def ocr_space_recognize(image_data: bytes) -> str:
+def _otsu_threshold(gray: "np.ndarray") -> int:
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    cum_mean = np.cumsum(hist * np.arange(256))
+    mean_bg = cum_mean / np.maximum(weight_bg, 1)
+    mean_fg = (cum_mean[-1] - cum_mean) / np.maximum(weight_fg, 1)
+    variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(variance))
+
+def _binary_open(mask: "np.ndarray") -> "np.ndarray":
+    # 2x2 開運算：先腐蝕再膨脹，去除 securimage 的單像素干擾線和噪點
+    eroded = np.zeros_like(mask)
+    eroded[:-1, :-1] = mask[:-1, :-1] & mask[1:, :-1] & mask[:-1, 1:] & mask[1:, 1:]
+    opened = eroded.copy()
+    opened[1:, :] |= eroded[:-1, :]
+    opened[:, 1:] |= eroded[:, :-1]
+    opened[1:, 1:] |= eroded[:-1, :-1]
+    return opened
+
+def preprocess_captcha(image_data: bytes) -> bytes:
+    """灰度、二值化、去除干擾線並裁剪到字形邊界框，返回緊湊的黑白 PNG"""
+    if not CAPTCHA_PREPROCESS or np is None or Image is None:
+        return image_data
+    try:
+        gray = np.asarray(Image.open(io.BytesIO(image_data)).convert("L"), dtype=np.uint8)
+        mask = gray <= _otsu_threshold(gray)
+        # 前景佔多數說明是深色背景淺色字，反轉
+        if mask.mean() > 0.5:
+            mask = ~mask
+        cleaned = _binary_open(mask)
+        if not cleaned.any():
+            cleaned = mask
+        if not cleaned.any():
+            return image_data
+        rows = np.flatnonzero(cleaned.any(axis=1))
+        cols = np.flatnonzero(cleaned.any(axis=0))
+        top = max(rows[0] - CAPTCHA_CROP_PADDING, 0)
+        bottom = min(rows[-1] + CAPTCHA_CROP_PADDING + 1, cleaned.shape[0])
+        left = max(cols[0] - CAPTCHA_CROP_PADDING, 0)
+        right = min(cols[-1] + CAPTCHA_CROP_PADDING + 1, cleaned.shape[1])
+        cropped = cleaned[top:bottom, left:right]
+        # 白底黑字，1 位深度 PNG
+        out = io.BytesIO()
+        Image.fromarray(np.where(cropped, 0, 255).astype(np.uint8)).convert("1").save(
+            out, format="PNG", optimize=True
+        )
+        return out.getvalue()
+    except Exception as e:
+        log(f"[Captcha Solver] 驗證碼預處理失敗，使用原圖: {e}")
+        return image_data
+
+_ddddocr_instance = None
+_ddddocr_lock = threading.Lock()
+# 限制同時進行的推理數，使 並發數 × 每次推理線程數 不超過 CPU 預算
+_inference_slots = threading.BoundedSemaphore(OCR_MAX_CONCURRENCY)
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+# create_ddddocr 臨時替換 onnxruntime.InferenceSession，本模塊中創建推理會話時持有此鎖
+_onnx_session_lock = threading.Lock()
+
+def ocr_intra_op_threads(concurrency: int = OCR_MAX_CONCURRENCY) -> int:
+    return OCR_INTRA_OP_THREADS or max(OCR_CPU_BUDGET // concurrency, 1)
+
+def quantized_model_path(model_path: str) -> str:
+    """按 OCR_QUANTIZED_MODEL 返回要加載的模型文件，量化失敗時退回原模型"""
+    if not OCR_QUANTIZED_MODEL:
+        return model_path
+    if OCR_QUANTIZED_MODEL != "auto":
+        return OCR_QUANTIZED_MODEL
+    target = os.path.join(STATE_DIR, os.path.splitext(os.path.basename(model_path))[0] + ".int8.onnx")
+    if not os.path.exists(target):
+        try:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            os.makedirs(STATE_DIR, exist_ok=True)
+            quantize_dynamic(model_path, target, weight_type=QuantType.QUInt8)
+        except Exception as e:
+            log(f"[Captcha Solver] 模型量化失敗，使用原模型: {e}")
+            return model_path
+    return target
+
+def ocr_session_options(intra_op_threads: int = 0, inter_op_threads: int = OCR_INTER_OP_THREADS,
+                        optimization: str = OCR_GRAPH_OPTIMIZATION):
+    """按 CPU 預算和圖優化級別創建 onnxruntime SessionOptions"""
+    import onnxruntime
+
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.intra_op_num_threads = intra_op_threads or ocr_intra_op_threads()
+    sess_options.inter_op_num_threads = inter_op_threads
+    if optimization not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"無效的圖優化級別: {optimization}")
+    sess_options.graph_optimization_level = getattr(
+        onnxruntime.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[optimization]
+    )
+    return sess_options
+
+def create_ddddocr(intra_op_threads: int = 0, inter_op_threads: int = OCR_INTER_OP_THREADS,
+                   optimization: str = OCR_GRAPH_OPTIMIZATION):
+    """創建 ddddocr 實例，按參數設置 onnxruntime 的線程數、圖優化級別和量化模型"""
+    import ddddocr
+    import onnxruntime
+
+    sess_options = ocr_session_options(intra_op_threads, inter_op_threads, optimization)
+    creator = threading.get_ident()
+    nested = []
+
+    # ddddocr 不接受 SessionOptions，創建實例期間臨時注入。只改寫本線程中 ddddocr 直接創建的會話，
+    # 其他線程和模型量化內部創建的會話原樣透傳
+    def tuned_session(model, options=None, *args, **kwargs):
+        if threading.get_ident() != creator or nested:
+            return inference_session(model, options, *args, **kwargs)
+        nested.append(model)
+        try:
+            if isinstance(model, str):
+                model = quantized_model_path(model)
+            return inference_session(model, options or sess_options, *args, **kwargs)
+        finally:
+            nested.pop()
+
+    # 持鎖期間替換模塊全局的工廠，並發的 create_ddddocr 不會把替換後的工廠當成原工廠保存
+    with _onnx_session_lock:
+        inference_session = onnxruntime.InferenceSession
+        onnxruntime.InferenceSession = tuned_session
+        try:
+            return ddddocr.DdddOcr(show_ad=False)
+        finally:
+            onnxruntime.InferenceSession = inference_session
+
+def get_ddddocr():
+    global _ddddocr_instance
+    with _ddddocr_lock:
+        if _ddddocr_instance is None:
+            _ddddocr_instance = create_ddddocr()
+        return _ddddocr_instance
+
+def _ocr_worker_init():
+    if OCR_WORKER_MEMORY_MB > 0:
+        import resource
+        limit = OCR_WORKER_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    return get_ddddocr()
+
+def ctc_top_k(probabilities: "np.ndarray", charset: Sequence[str], k: int,
+              prune: int = 3) -> List[Tuple[str, float]]:
+    """CTC 前綴束搜索，返回概率最高的 k 個字符串及其相對概率；charset[0] 為空白符"""
+    beams = {(): (1.0, 0.0)}  # 前綴 -> (以空白結尾的概率, 以字符結尾的概率)
+    for row in probabilities:
+        top = [int(c) for c in np.argpartition(row, -prune)[-prune:] if c != 0]
+        next_beams = {}
+
+        def add(prefix, blank=0.0, char=0.0):
+            pb, pc = next_beams.get(prefix, (0.0, 0.0))
+            next_beams[prefix] = (pb + blank, pc + char)
+
+        for prefix, (pb, pc) in beams.items():
+            add(prefix, blank=(pb + pc) * row[0])
+            for c in top:
+                p = row[c]
+                if prefix and prefix[-1] == c:
+                    # 重複字符：中間有空白才算新字符，否則合併
+                    add(prefix + (c,), char=pb * p)
+                    add(prefix, char=pc * p)
+                else:
+                    add(prefix + (c,), char=(pb + pc) * p)
+        beams = dict(sorted(next_beams.items(), key=lambda kv: -sum(kv[1]))[:k * 2])
+    ranked = sorted(beams.items(), key=lambda kv: -sum(kv[1]))[:k]
+    total = sum(sum(scores) for _, scores in ranked) or 1.0
+    return [("".join(charset[c] for c in prefix), float(sum(scores) / total)) for prefix, scores in ranked]
+
+def _ddddocr_candidates(ocr, image_data: bytes, k: int) -> List[Tuple[str, Optional[float]]]:
+    with _inference_slots:
+        return _classify(ocr, image_data, k)
+
+def _classify(ocr, image_data: bytes, k: int) -> List[Tuple[str, Optional[float]]]:
+    try:
+        result = ocr.classification(image_data, probability=True)
+        # 不同 ddddocr 版本的鍵名不同
+        charset = result.get("charset") or result.get("charsets")
+        probabilities = np.asarray(result.get("probabilities") or result.get("probability"))
+        probabilities = probabilities.reshape(-1, len(charset))
+        return ctc_top_k(probabilities, charset, k)
+    except Exception:
+        return [(ocr.classification(image_data), None)]
+
+def _ocr_worker_handle(ocr, image_data: bytes) -> dict:
+    try:
+        return {"candidates": _ddddocr_candidates(ocr, image_data, CAPTCHA_TOP_K)}
+    except Exception as e:
+        return {"error": str(e)}
+
+def _ocr_process_main(conn):
+    ocr = _ocr_worker_init()
+    while conn.poll(OCR_WORKER_IDLE_TIMEOUT or None):
+        try:
+            image_data = conn.recv_bytes()
+        except EOFError:
+            break
+        conn.send(_ocr_worker_handle(ocr, image_data))
+    conn.close()
+
+class OcrProcessClient:
+    """在 spawn 子進程中運行 ddddocr，主進程不加載 onnxruntime 和模型"""
+
+    def __init__(self):
+        self._process = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._process is not None and self._process.is_alive():
+            return
+        ctx = multiprocessing.get_context("spawn")
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_ocr_process_main, args=(child_conn,), daemon=True)
+        self._process.start()
+        child_conn.close()
+
+    def _restart(self):
+        if self._process is not None:
+            self._process.kill()
+        self._process = None
+        self._ensure_started()
+
+    def _exchange(self, image_data: bytes) -> dict:
+        self._conn.send_bytes(image_data)
+        if not self._conn.poll(call_timeout(OCR_DAEMON_START_TIMEOUT)):
+            self._process.kill()
+            raise TimeoutError("OCR 子進程響應超時")
+        return self._conn.recv()
+
+    def recognize(self, image_data: bytes) -> List[Tuple[str, Optional[float]]]:
+        with self._lock:
+            self._ensure_started()
+            try:
+                reply = self._exchange(image_data)
+            except (EOFError, ConnectionError):
+                # 子進程可能在 is_alive() 檢查之後恰好因空閒超時退出，重啟後重試一次
+                self._restart()
+                reply = self._exchange(image_data)
+        if "error" in reply:
+            raise Exception(reply["error"])
+        return [tuple(candidate) for candidate in reply["candidates"]]
+
+def _send_frame(sock: socket.socket, payload: bytes):
+    sock.sendall(struct.pack(">I", len(payload)) + payload)
+
+def _recv_frame(sock: socket.socket) -> bytes:
+    def recv_exact(n: int) -> bytes:
+        buf = b""
+        while len(buf) < n:
+            chunk = sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("連接已關閉")
+            buf += chunk
+        return buf
+    (length,) = struct.unpack(">I", recv_exact(4))
+    return recv_exact(length)
+
+class _OcrDaemonHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        server.last_active = time.monotonic()
+        try:
+            image_data = _recv_frame(self.request)
+        except ConnectionError:
+            return
+        reply = _ocr_worker_handle(server.ocr, image_data)
+        _send_frame(self.request, json.dumps(reply).encode('utf-8'))
+        server.last_active = time.monotonic()
+
+def run_ocr_daemon(socket_path: str = OCR_WORKER_SOCKET):
+    """常駐的 OCR 守護進程，模型只加載一次，供本機所有續期進程共享"""
+    if os.path.exists(socket_path):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                probe.connect(socket_path)
+            log(f"[Captcha Solver] OCR 守護進程已在運行: {socket_path}")
+            return
+        except OSError:
+            os.unlink(socket_path)
+    ocr = _ocr_worker_init()
+    server = socketserver.ThreadingUnixStreamServer(socket_path, _OcrDaemonHandler)
+    server.daemon_threads = True
+    server.ocr = ocr
+    server.last_active = time.monotonic()
+    os.chmod(socket_path, 0o600)
+
+    def idle_watchdog():
+        while time.monotonic() - server.last_active < OCR_WORKER_IDLE_TIMEOUT:
+            time.sleep(min(OCR_WORKER_IDLE_TIMEOUT, 5))
+        server.shutdown()
+
+    if OCR_WORKER_IDLE_TIMEOUT > 0:
+        threading.Thread(target=idle_watchdog, daemon=True).start()
+    log(f"[Captcha Solver] OCR 守護進程已啟動: {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+class OcrDaemonClient:
+    """通過 Unix socket 調用 OCR 守護進程，守護進程不存在時自動拉起"""
+
+    def __init__(self, socket_path: str = OCR_WORKER_SOCKET):
+        self.socket_path = socket_path
+        self._lock = threading.Lock()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            return sock
+        except OSError:
+            sock.close()
+            raise
+
+    def _start_daemon(self) -> socket.socket:
+        log(f"[Captcha Solver] 正在啟動 OCR 守護進程: {self.socket_path}")
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--ocr-daemon"],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        started = time.monotonic()
+        while True:
+            try:
+                return self._connect()
+            except OSError:
+                if time.monotonic() - started > OCR_DAEMON_START_TIMEOUT:
+                    raise TimeoutError("OCR 守護進程啟動超時")
+                if current_deadline().expired():
+                    raise DeadlineExceeded("時間預算已耗盡")
+                time.sleep(0.2)
+
+    def connect(self) -> socket.socket:
+        try:
+            return self._connect()
+        except OSError:
+            with self._lock:
+                try:
+                    return self._connect()
+                except OSError:
+                    return self._start_daemon()
+
+    def _exchange(self, image_data: bytes) -> dict:
+        with self.connect() as sock:
+            sock.settimeout(call_timeout(OCR_DAEMON_START_TIMEOUT))
+            _send_frame(sock, image_data)
+            return json.loads(_recv_frame(sock).decode('utf-8'))
+
+    def recognize(self, image_data: bytes) -> List[Tuple[str, Optional[float]]]:
+        try:
+            reply = self._exchange(image_data)
+        except ConnectionError:
+            # 守護進程可能在連接之後恰好因空閒超時退出；重新連接時會按需重新拉起
+            reply = self._exchange(image_data)
+        if "error" in reply:
+            raise Exception(reply["error"])
+        return [tuple(candidate) for candidate in reply["candidates"]]
+
+_ocr_clients = {}
+_ocr_clients_lock = threading.Lock()
+
+def get_ocr_client():
+    with _ocr_clients_lock:
+        if OCR_WORKER not in _ocr_clients:
+            _ocr_clients[OCR_WORKER] = OcrProcessClient() if OCR_WORKER == "process" else OcrDaemonClient()
+        return _ocr_clients[OCR_WORKER]
+
+def ocr_candidates(image_data: bytes) -> List[Tuple[str, Optional[float]]]:
+    """按 OCR_WORKER 設置在主進程、子進程或守護進程中識別驗證碼，返回 (文本, 置信度) 候選列表"""
+    if OCR_WORKER == "inline":
+        return _ddddocr_candidates(get_ddddocr(), image_data, CAPTCHA_TOP_K)
+    return get_ocr_client().recognize(image_data)
+
+def warm_ocr():
+    """提前加載 OCR 模型：inline 模式在本進程加載，其他模式提前拉起子進程或守護進程"""
+    if OCR_WORKER == "inline":
+        get_ddddocr()
+    elif OCR_WORKER == "process":
+        client = get_ocr_client()
+        with client._lock:
+            client._ensure_started()
+    else:
+        get_ocr_client().connect().close()
+
+def captcha_model_input(image_data: bytes, height: int, width: int) -> "np.ndarray":
+    """自訓練模型的輸入：灰度圖縮放到固定大小，形狀 (1, 1, H, W)，取值 0 到 1"""
+    image = Image.open(io.BytesIO(image_data)).convert("L").resize((width, height), Image.BILINEAR)
+    return (np.asarray(image, dtype=np.float32) / 255.0)[None, None]
+
+class CaptchaModel:
+    """train_captcha.py 導出的 CRNN 模型，輸出每個時間步的字符概率，用 CTC 束搜索解碼"""
+
+    def __init__(self, path: str):
+        import onnxruntime
+
+        # 模型旁的同名 JSON 記錄字符集（第 0 個為空白符）和輸入尺寸
+        with open(os.path.splitext(path)[0] + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.charset = meta["charset"]
+        self.height = meta["height"]
+        self.width = meta["width"]
+        with _onnx_session_lock:
+            self.session = onnxruntime.InferenceSession(
+                path, ocr_session_options(), providers=["CPUExecutionProvider"]
+            )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def candidates(self, image_data: bytes, k: int) -> List[Tuple[str, float]]:
+        inputs = captcha_model_input(image_data, self.height, self.width)
+        with _inference_slots:
+            probabilities = self.session.run(None, {self.input_name: inputs})[0]
+        return ctc_top_k(probabilities[0], self.charset, k)
+
+_captcha_model = None
+_captcha_model_lock = threading.Lock()
+
+def get_captcha_model() -> CaptchaModel:
+    global _captcha_model
+    with _captcha_model_lock:
+        if _captcha_model is None:
+            _captcha_model = CaptchaModel(CAPTCHA_MODEL_PATH)
+        return _captcha_model
+
+def harvest_captcha(image_data: bytes, answer: Optional[str], tried: Sequence[str]):
+    """保存驗證碼樣本：通過驗證的以答案命名存入 passed/，未通過的連同嘗試過的答案存入 failed/"""
+    if not CAPTCHA_HARVEST_DIR or not image_data:
+        return
+    digest = hashlib.sha1(image_data).hexdigest()[:12]
+    extension = ".png" if image_data.startswith(b"\x89PNG") else ".jpg"
+    try:
+        if answer:
+            directory = os.path.join(CAPTCHA_HARVEST_DIR, "passed")
+            name = f"{re.sub(r'[^0-9A-Za-z+-]', '', answer)}_{digest}{extension}"
+        else:
+            directory = os.path.join(CAPTCHA_HARVEST_DIR, "failed")
+            name = f"{digest}{extension}"
+            _write_state_file(os.path.join(directory, f"{digest}.json"), {"tried": list(tried)})
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(image_data)
+    except OSError as e:
+        log(f"[Captcha Solver] 驗證碼樣本保存失敗: {e}")
+
+CAPTCHA_ENGINES = ("custom", "OCR.space", "TrueCaptcha", "ddddocr")
+
+class EngineSelector:
+    """多臂老虎機：按各引擎的驗證通過率（Thompson 採樣）和延遲排序，使預期登錄耗時最短"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._stats = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if self._stats is None:
+            self._stats = {}
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, encoding="utf-8") as f:
+                        self._stats = json.load(f)
+                except (OSError, ValueError):
+                    pass
+        return self._stats
+
+    def expected_cost(self, engine: str, sample: bool = True) -> float:
+        stats = self._load().get(engine, {})
+        passed, failed = stats.get("passed", 0.0), stats.get("failed", 0.0)
+        if sample:
+            p = random.betavariate(1 + passed, 1 + failed)
+        else:
+            p = (1 + passed) / (2 + passed + failed)
+        latency = stats.get("latency", 1.0)
+        return (latency + (1 - p) * CAPTCHA_FAILURE_COST) / max(p, 1e-3)
+
+    def order(self, engines: Sequence[str], sample: bool = True) -> List[str]:
+        if CAPTCHA_ENGINE_SELECTION != "adaptive":
+            return list(engines)
+        with self._lock:
+            return sorted(engines, key=lambda engine: self.expected_cost(engine, sample))
+
+    def seen(self) -> bool:
+        """以往的運行是否識別過驗證碼"""
+        with self._lock:
+            return bool(self._load())
+
+    def record(self, engine: str, latency: float, passed: bool):
+        with self._lock:
+            stats = self._load()
+            for other in stats.values():
+                other["passed"] = other.get("passed", 0.0) * CAPTCHA_STATS_DECAY
+                other["failed"] = other.get("failed", 0.0) * CAPTCHA_STATS_DECAY
+            entry = stats.setdefault(engine, {"passed": 0.0, "failed": 0.0, "latency": latency})
+            entry["passed" if passed else "failed"] += 1
+            entry["latency"] = 0.7 * entry["latency"] + 0.3 * latency
+            if self.path:
+                try:
+                    _write_state_file(self.path, stats)
+                except OSError as e:
+                    log(f"[Captcha Solver] 驗證碼引擎統計保存失敗: {e}")
+
+engine_selector = EngineSelector(os.path.join(STATE_DIR, "captcha_engines.json"))
+
+def available_captcha_engines() -> List[str]:
+    """已配置的驗證碼引擎，按 CAPTCHA_ENGINES 的順序"""
+    return [
+        name for name in CAPTCHA_ENGINES
+        if (name != "custom" or CAPTCHA_MODEL_PATH)
+        and (name != "OCR.space" or OCR_SPACE_API_KEY)
+        and (name != "TrueCaptcha" or (TRUECAPTCHA_USERID and TRUECAPTCHA_APIKEY))
+    ]
+
+def captcha_likely() -> bool:
+    """推測式識別每次登錄都會識別驗證碼；否則只有以往出現過驗證碼時才值得預熱"""
+    return CAPTCHA_SPECULATIVE in ("prefetch", "inline") or engine_selector.seen()
+
+def captcha_solver(captcha_image_url: str, session: requests.Session, record: bool = True) -> dict:
+    """下載並識別驗證碼。record 為 False 時（推測性識別）引擎失敗不立即計入統計，
+    而是放在結果的 failed_engines 中，由實際提交驗證碼的一方記錄"""
+    failed_engines = []
+    def ocr_space_recognize(image_data: bytes) -> List[Tuple[str, Optional[float]]]:
         api_key = os.getenv('OCR_SPACE_API_KEY', '').encode().decode('utf-8', errors='replace')
         if not api_key:
             raise ValueError("OCR_SPACE_API_KEY 未設置")
@@ -100,112 +1014,542 @@ def captcha_solver(captcha_image_url: str, session: requests.Session) -> dict:
             "apikey": api_key,
             "language": "eng",
             "isOverlayRequired": False,
-            "base64Image": "data:image/jpeg;base64," + base64.b64encode(image_data).decode('utf-8'),
+            "filetype": "PNG" if image_data[:8] == b"\x89PNG\r\n\x1a\n" else "JPG",
             "isTable": False,
             "scale": True,
             "OCREngine": 2
         }
+        # 以 multipart 直接上傳二進位圖片，避免 base64 帶來的約 33% 體積膨脹
+        files = {"file": ("captcha", image_data, "application/octet-stream")}
         try:
-            response = session.post(url, data=payload, timeout=10)
+            response = BREAKERS["OCR.space"].request(
+                "POST", url, session=session, data=payload, files=files,
+                timeout=call_timeout(10)
+            )
             response.raise_for_status()
             result = response.json()
             if "ParsedResults" in result and len(result["ParsedResults"]) > 0:
-                return result["ParsedResults"][0]["ParsedText"].strip()
+                return [(result["ParsedResults"][0]["ParsedText"].strip(), None)]
             else:
                 raise Exception("OCR.space 無法識別文本")
+        except (CircuitOpenError, DeadlineExceeded):
+            # 熔斷和時間預算耗盡原樣拋出，由調用方跳過引擎而不計為識別失敗
+            raise
         except Exception as e:
             raise Exception(f"OCR.space 錯誤: {e}")
 
-    def ddddocr_recognize(image_data: bytes) -> str:
+    def truecaptcha_recognize(image_data: bytes) -> List[Tuple[str, Optional[float]]]:
+        if not TRUECAPTCHA_USERID or not TRUECAPTCHA_APIKEY:
+            raise ValueError("TRUECAPTCHA_USERID 或 TRUECAPTCHA_APIKEY 未設置")
+        data = {
+            "userid": TRUECAPTCHA_USERID,
+            "apikey": TRUECAPTCHA_APIKEY,
+            "case": "mixed",
+            "mode": "human",
+            "data": base64.b64encode(image_data).decode('utf-8'),
+        }
+        try:
+            response = BREAKERS["TrueCaptcha"].request(
+                "POST", "https://api.apitruecaptcha.org/one/gettext", json=data,
+                timeout=call_timeout(10)
+            )
+            response.raise_for_status()
+            result = response.json()
+            if "result" in result:
+                return [(str(result["result"]).strip(), None)]
+            raise Exception(result.get("error", "TrueCaptcha 無法識別文本"))
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            raise Exception(f"TrueCaptcha 錯誤: {e}")
+
+    def ddddocr_recognize(image_data: bytes) -> List[Tuple[str, Optional[float]]]:
         try:
-            ocr = ddddocr.DdddOcr()
-            result = ocr.classification(image_data)
-            return result.strip()
+            return [(text.strip(), confidence) for text, confidence in ocr_candidates(image_data)]
         except Exception as e:
             raise Exception(f"ddddocr 錯誤: {e}")
 
+    def custom_recognize(image_data: bytes) -> List[Tuple[str, Optional[float]]]:
+        try:
+            return get_captcha_model().candidates(image_data, CAPTCHA_TOP_K)
+        except Exception as e:
+            raise Exception(f"自訓練模型錯誤: {e}")
+
     for attempt in range(CAPTCHA_MAX_RETRY_COUNT):
         try:
-            response = session.get(captcha_image_url, timeout=10)
+            response = session.get(captcha_image_url, timeout=call_timeout(10))
             response.raise_for_status()
-            image_data = response.content
             log(f"[Captcha Solver] 驗證碼圖片下載成功 (嘗試 {attempt + 1}/{CAPTCHA_MAX_RETRY_COUNT})")
+            image_data = preprocess_captcha(response.content)
             
-            # 嘗試 OCR.space
-            try:
-                ocr_space_result = ocr_space_recognize(image_data)
-                if ocr_space_result:
-                    log(f"[Captcha Solver] OCR.space 識別結果: {ocr_space_result}")
-                    return {"result": ocr_space_result}
-            except Exception as e:
-                log(f"[Captcha Solver] OCR.space 失敗: {e}")
+            recognizers = {
+                "custom": custom_recognize,
+                "OCR.space": ocr_space_recognize,
+                "TrueCaptcha": truecaptcha_recognize,
+                "ddddocr": ddddocr_recognize,
+            }
+            # 按歷史表現排序，失敗或無結果時依次嘗試下一個引擎
+            for name in engine_selector.order(available_captcha_engines()):
+                started = time.monotonic()
+                try:
+                    candidates = [c for c in recognizers[name](image_data) if c[0]]
+                except CircuitOpenError as e:
+                    # 已熔斷的服務直接跳過，不計入引擎統計
+                    log(f"[Circuit Breaker] {e}")
+                    continue
+                except Exception as e:
+                    log(f"[Captcha Solver] {name} 失敗: {e}")
+                    candidates = []
+                latency = time.monotonic() - started
+                if candidates:
+                    log(f"[Captcha Solver] {name} 識別結果: {candidates[0][0]}")
+                    return {
+                        "result": candidates[0][0],
+                        "candidates": candidates,
+                        "engine": name,
+                        "latency": latency,
+                        "image": response.content,
+                        "failed_engines": failed_engines,
+                    }
+                if record:
+                    engine_selector.record(name, latency, False)
+                else:
+                    failed_engines.append((name, latency))
 
-            # 嘗試 ddddocr
-            try:
-                ddddocr_result = ddddocr_recognize(image_data)
-                if ddddocr_result:
-                    log(f"[Captcha Solver] ddddocr 識別結果: {ddddocr_result}")
-                    return {"result": ddddocr_result}
-            except Exception as e:
-                log(f"[Captcha Solver] ddddocr 失敗: {e}")
-                
             log(f"[Captcha Solver] 驗證碼識別失敗，正在重試 (嘗試 {attempt + 1}/{CAPTCHA_MAX_RETRY_COUNT})")
         except Exception as e:
             log(f"[Captcha Solver] 下載圖像失敗: {e}")
         
         if attempt < CAPTCHA_MAX_RETRY_COUNT - 1:
-            time.sleep(2)  # 等待 2 秒後重試
+            wait(2)  # 等待 2 秒後重試
             
-    return {"error": "兩種 OCR 服務均無法識別驗證碼"}
+    return {"error": "所有 OCR 服務均無法識別驗證碼", "failed_engines": failed_engines}
+
+def record_speculative_failures(solved: Optional[dict]):
+    """推測性識別的結果確實用於驗證碼時，補記其中失敗的引擎"""
+    for name, latency in (solved or {}).get("failed_engines", ()):
+        engine_selector.record(name, latency, False)
+
+class CaptchaCandidate(NamedTuple):
+    answer: str
+    score: float
+    text: str
+
+_ARITHMETIC_OPERATORS = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+}
+
+def _eval_arithmetic_node(node) -> int:
+    if isinstance(node, ast.Constant) and type(node.value) is int and node.value < 1000:
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return -_eval_arithmetic_node(node.operand)
+    if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC_OPERATORS:
+        return _ARITHMETIC_OPERATORS[type(node.op)](
+            _eval_arithmetic_node(node.left), _eval_arithmetic_node(node.right)
+        )
+    raise ValueError("不支持的表達式")
+
+def safe_eval_arithmetic(expression: str) -> Optional[int]:
+    """只允許整數的加、減、乘運算，其餘任何語法都返回 None"""
+    expression = re.sub(r"(?<=\d)\s*[xX×]\s*(?=\d)", "*", expression).rstrip("=? ")
+    if not re.fullmatch(r"[\d\s+\-*()]{1,20}", expression) or not re.search(r"\d\s*[+\-*]", expression):
+        return None
+    try:
+        return _eval_arithmetic_node(ast.parse(expression, mode="eval").body)
+    except (SyntaxError, ValueError, RecursionError):
+        return None
+
+def _captcha_text_score(text: str) -> float:
+    if not text:
+        return 0.0
+    alphabet = CAPTCHA_ALPHABET.lower()
+    in_alphabet = sum(1 for ch in text.lower() if ch in alphabet) / len(text)
+    return in_alphabet ** 2 * 0.5 ** abs(len(text) - CAPTCHA_LENGTH)
+
+def rank_captcha_candidates(hypotheses: Sequence[Tuple[str, Optional[float]]]) -> List[CaptchaCandidate]:
+    """給各引擎的候選結果打分：算術表達式直接求值，其餘按 securimage 的字符集和長度評估"""
+    merged = {}
+    for text, confidence in hypotheses:
+        text = str(text).strip().encode('utf-8', errors='replace').decode('utf-8')
+        demo = re.findall(r"RESULT  IS . (.*) .", text)
+        if demo:
+            text = demo[0]
+        value = safe_eval_arithmetic(text)
+        answer = str(value) if value is not None else re.sub(r'[^a-zA-Z0-9]', '', text)
+        if not answer:
+            continue
+        # securimage 不區分大小寫，只有大小寫不同的候選合併置信度
+        key = answer.lower()
+        confidence = 0.6 if confidence is None else float(confidence)
+        if key in merged:
+            first, total, arithmetic = merged[key]
+            merged[key] = (first, total + confidence, arithmetic)
+        else:
+            merged[key] = (CaptchaCandidate(answer, 0.0, text), confidence, value is not None)
+    ranked = []
+    for candidate, confidence, arithmetic in merged.values():
+        score = confidence + 1.0 if arithmetic else confidence * _captcha_text_score(candidate.answer)
+        ranked.append(candidate._replace(score=score))
+    return sorted(ranked, key=lambda c: -c.score)
 
 def handle_captcha_solved_result(solved: dict) -> str:
     if "result" in solved:
         text = str(solved["result"]).strip().encode('utf-8', errors='replace').decode('utf-8')
         log(f"[Captcha Solver] 原始識別結果: {text}")
-        
-        # 移除非字母數字字符，僅保留可能有效的驗證碼
-        cleaned_text = re.sub(r'[^a-zA-Z0-9]', '', text)
-        if cleaned_text:
-            return cleaned_text
-        
-        # 如果識別結果包含運算符，嘗試計算
-        operators = ["X", "x", "+", "-", "*"]
-        for operator in operators:
-            operator_pos = text.find(operator)
-            if operator_pos != -1:
-                left_part = text[:operator_pos].strip()
-                right_part = text[operator_pos + 1:].strip()
-                if left_part.isdigit() and right_part.isdigit():
-                    operator = "*" if operator.lower() == "x" else operator
-                    try:
-                        return str(eval(f"{left_part} {operator} {right_part}"))
-                    except:
-                        pass
-        return cleaned_text or text
+        ranked = rank_captcha_candidates(solved.get("candidates") or [(text, None)])
+        # 保留排序後的備選答案，驗證失敗時無需重新識別即可嘗試
+        solved["ranked"] = ranked
+        return ranked[0].answer if ranked else text
     else:
         log(f"[Captcha Solver] 無效的解析結果: {solved}")
         raise KeyError("未找到解析結果。")
 
-def get_pin_from_mailparser(url_id: str) -> str:
+# 共用收件箱的 download URL ID；main_handler 在只配置一個 ID 而有多個賬號時填充
+shared_inboxes = set()
+_mailparser_cache = {}
+_mailparser_lock = threading.Lock()
+# 共用收件箱中每個收件人最近一次用掉的 PIN 郵件的收件時間
+_mailparser_consumed: Dict[str, float] = {}
+
+def _mailparser_entry_time(entry: dict) -> Optional[float]:
+    value = entry.get(MAILPARSER_TIME_FIELD)
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def _mailparser_receivers(value) -> set:
+    """解析收件人字段（"Name <a@x.com>, b@x.com" 或其列表）中的郵箱地址"""
+    fields = value if isinstance(value, list) else [value]
+    return {address.lower() for _, address in getaddresses([str(f) for f in fields if f]) if address}
+
+def _mailparser_find(
+    entries: list, receiver: Optional[str], since: float, shared: bool
+) -> Optional[Tuple[str, Optional[float]]]:
+    """在解析結果中找出發給 receiver 且不早於 since 的最新 PIN 及其收件時間；獨佔收件箱直接取最新一條"""
+    if not shared:
+        if entries and isinstance(entries[0], dict) and "pin" in entries[0]:
+            return str(entries[0]["pin"]), None
+        return None
+    # 時鐘偏差的容忍範圍內可能包含同一賬號上一個訂單已用過的 PIN，只接受更晚收到的郵件
+    with _mailparser_lock:
+        consumed = _mailparser_consumed.get((receiver or "").lower())
+    matches = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or "pin" not in entry:
+            continue
+        if not receiver or receiver.lower() not in _mailparser_receivers(entry.get(MAILPARSER_RECEIVER_FIELD)):
+            continue
+        # 沒有時間字段的郵件無法排除上一次申請的舊 PIN
+        received_at = _mailparser_entry_time(entry)
+        if received_at is None or received_at < since - MAILPARSER_CLOCK_SKEW:
+            continue
+        if consumed is not None and received_at <= consumed:
+            continue
+        matches.append((received_at, -index, entry))
+    if not matches:
+        return None
+    received_at, _, entry = max(matches, key=lambda m: m[:2])
+    return str(entry["pin"]), received_at
+
+def _mailparser_match(entries: list, receiver: Optional[str], since: float, shared: bool) -> Optional[str]:
+    found = _mailparser_find(entries, receiver, since, shared)
+    return found[0] if found else None
+
+def _mailparser_claim(receiver: Optional[str], found: Tuple[str, Optional[float]]) -> str:
+    """記下共用收件箱中已交給 receiver 的郵件，之後的申請不會再拿到這個 PIN"""
+    pin, received_at = found
+    if receiver and received_at is not None:
+        with _mailparser_lock:
+            _mailparser_consumed[receiver.lower()] = received_at
+    return pin.encode('utf-8', errors='replace').decode('utf-8')
+
+def fetch_mailparser_entries(url_id: str) -> Tuple[float, list]:
+    response = BREAKERS["Mailparser"].request(
+        "GET", f"{MAILPARSER_DOWNLOAD_BASE_URL}{url_id}", timeout=call_timeout(10)
+    )
+    response.raise_for_status()
+    data = response.json()
+    if not isinstance(data, list):
+        raise ValueError("無效的 Mailparser 響應")
+    fetched = (clock.time(), data)
+    with _mailparser_lock:
+        _mailparser_cache[url_id] = fetched
+    return fetched
+
+def get_pin_from_mailparser(url_id: str, receiver: Optional[str] = None, since: float = 0.0) -> str:
+    """獲取 PIN；共用收件箱時只接受發給 receiver、且在 since 之後收到的郵件"""
+    shared = url_id in shared_inboxes
+    # 其他賬號在 PIN 申請之後拉取過的結果可以直接使用，不必再次請求
+    with _mailparser_lock:
+        fetched_at, entries = _mailparser_cache.get(url_id, (0.0, []))
+    if shared and fetched_at >= since:
+        found = _mailparser_find(entries, receiver, since, shared)
+        if found:
+            return _mailparser_claim(receiver, found)
     for attempt in range(3):
         try:
-            response = requests.get(
-                f"{MAILPARSER_DOWNLOAD_BASE_URL}{url_id}",
-                timeout=10
-            )
-            response.raise_for_status()
-            data = response.json()
-            if data and isinstance(data, list) and "pin" in data[0]:
-                pin = str(data[0]["pin"]).encode('utf-8', errors='replace').decode('utf-8')
-                return pin
+            _, entries = fetch_mailparser_entries(url_id)
+            found = _mailparser_find(entries, receiver, since, shared)
+            if found:
+                return _mailparser_claim(receiver, found)
             else:
-                raise ValueError("無效的 Mailparser 響應")
+                raise ValueError("沒有發給該賬號的 PIN" if shared else "無效的 Mailparser 響應")
+        except CircuitOpenError as e:
+            raise ValueError(f"Mailparser 不可用: {e}")
         except Exception as e:
             log(f"[MailParser] PIN 獲取失敗 (嘗試 {attempt + 1}/3): {e}")
             if attempt < 2:
-                time.sleep(10)
+                wait(10)
     raise ValueError("多次嘗試後無法獲取 PIN")
 
+# 出口池中代理支持的協議，socks 需要 requests[socks]
+EGRESS_PROXY_SCHEMES = ("http", "https", "socks4", "socks4a", "socks5", "socks5h")
+
+class Egress:
+    def __init__(self, spec: str):
+        """無效的出口（未知的代理協議、缺少主機或端口錯誤、無效的 IP 地址）拋出 ValueError"""
+        self.spec = spec
+        self.proxy = spec if "://" in spec else None
+        self.source_address = None
+        if self.proxy is None:
+            address = spec[len("src:"):] if spec.startswith("src:") else spec
+            self.source_address = str(ipaddress.ip_address(address.strip("[]")))
+        else:
+            parts = urlsplit(spec)
+            # 訪問 port 時會校驗端口
+            if parts.scheme.lower() not in EGRESS_PROXY_SCHEMES or not parts.hostname or parts.port == 0:
+                raise ValueError(f"無效的代理: {spec}")
+        self.healthy = True
+        self.latency = None
+        self.failures = 0
+
+class EgressAdapter(HTTPAdapter):
+    """把會話綁定到指定出口：設置本機源地址，並統計連接失敗"""
+
+    def __init__(self, pool: "EgressPool", egress: Egress, **kwargs):
+        self.pool = pool
+        self.egress = egress
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.egress.source_address:
+            kwargs["source_address"] = (self.egress.source_address, 0)
+        super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        if self.egress.source_address:
+            proxy_kwargs["source_address"] = (self.egress.source_address, 0)
+        return super().proxy_manager_for(proxy, **proxy_kwargs)
+
+    def send(self, request, **kwargs):
+        try:
+            response = super().send(request, **kwargs)
+        except requests.ConnectionError:
+            self.pool.record_failure(self.egress)
+            raise
+        self.pool.record_success(self.egress)
+        return response
+
+class EgressPool:
+    """代理和本機源地址組成的出口池，健康檢查後按延遲排序，賬號通過一致性哈希固定到出口"""
+
+    def __init__(self, specs: List[str]):
+        self.egresses = []
+        for spec in specs:
+            try:
+                self.egresses.append(Egress(spec))
+            except ValueError as e:
+                log(f"[Egress] 已忽略無效的出口 {spec}: {e}")
+        self.assignments = {}
+        self._checked = False
+        self._lock = threading.Lock()
+        # 連接失敗計數單獨加鎖：健康檢查在持有 _lock 時從其他線程發出請求，也會記錄失敗
+        self._failures_lock = threading.Lock()
+
+    def _mount(self, session: requests.Session, egress: Egress) -> requests.Session:
+        adapter = EgressAdapter(self, egress)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if egress.proxy:
+            session.proxies = {"http": egress.proxy, "https": egress.proxy}
+        return session
+
+    def _check(self, egress: Egress):
+        started = time.monotonic()
+        try:
+            with self._mount(create_session(), egress) as session:
+                response = session.get(
+                    EGRESS_CHECK_URL, headers={"user-agent": user_agent}, timeout=EGRESS_CHECK_TIMEOUT
+                )
+                response.raise_for_status()
+            egress.latency = time.monotonic() - started
+            egress.healthy = egress.latency <= EGRESS_MAX_LATENCY
+        except Exception:
+            egress.latency = None
+            egress.healthy = False
+
+    def health_check(self):
+        with ThreadPoolExecutor(max_workers=len(self.egresses)) as executor:
+            list(executor.map(self._check, self.egresses))
+        self.egresses.sort(key=lambda e: (not e.healthy, e.latency or float("inf")))
+        ranking = ", ".join(
+            f"{e.spec} {e.latency * 1000:.0f}ms" if e.healthy else f"{e.spec} 不可用" for e in self.egresses
+        )
+        log(f"[Egress] 出口健康檢查: {ranking}")
+        self._checked = True
+
+    def warm(self):
+        with self._lock:
+            if not self._checked:
+                self.health_check()
+
+    def record_success(self, egress: Egress):
+        with self._failures_lock:
+            egress.failures = 0
+
+    def record_failure(self, egress: Egress):
+        with self._failures_lock:
+            egress.failures += 1
+            disabled = egress.healthy and egress.failures >= EGRESS_MAX_FAILURES
+            if disabled:
+                egress.healthy = False
+        if disabled:
+            log(f"[Egress] 出口 {egress.spec} 連續連接失敗，已停用")
+
+    def assign(self, account: str) -> Egress:
+        with self._lock:
+            if not self._checked:
+                self.health_check()
+            current = self.assignments.get(account)
+            if current is not None and current.healthy:
+                return current
+            candidates = [e for e in self.egresses if e.healthy]
+            if not candidates:
+                log("[Egress] 沒有可用的出口，使用延遲最低的出口繼續嘗試")
+                candidates = self.egresses[:1]
+            # 最高隨機權重哈希：出口集合不變時，同一賬號每次運行都落在同一個出口
+            chosen = max(
+                candidates,
+                key=lambda e: hashlib.sha1(f"{account}|{e.spec}".encode('utf-8')).digest(),
+            )
+            if current is not None and chosen is not current:
+                log(f"[Egress] 出口 {current.spec} 不可用，賬號改用 {chosen.spec}")
+            self.assignments[account] = chosen
+            return chosen
+
+    def session(self, account: str) -> requests.Session:
+        return self._mount(create_session(), self.assign(account))
+
+def create_egress_pool(specs: List[str]) -> Optional[EgressPool]:
+    """創建出口池；沒有配置或全部無效時返回 None，直接使用本機默認出口"""
+    pool = EgressPool(specs) if specs else None
+    if pool is not None and not pool.egresses:
+        log("[Egress] 沒有有效的出口，使用本機默認出口")
+        return None
+    return pool
+
+egress_pool = create_egress_pool(EGRESS_POOL)
+
+def new_session(username: str) -> requests.Session:
+    """創建賬號的會話；配置了出口池時綁定到該賬號固定的出口，設置了 HTTP_TRACE_DIR 時記錄請求"""
+    if egress_pool is None:
+        return trace_session(create_session())
+    return trace_session(egress_pool.session(username))
+
+def warm_connection(session: requests.Session, url: str):
+    """發送一個 HEAD 請求，讓連接池中提前建立好 TLS 連接"""
+    try:
+        session.head(url, timeout=5).close()
+    except requests.RequestException:
+        pass
+
+class StartupPipeline:
+    """冷啟動流水線：在後台線程中執行預熱任務，與第一個賬號的登錄請求重疊"""
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self._executor = None
+        self._tasks = {}
+
+    def _run(self, name: str, func, *args):
+        started = time.monotonic()
+        try:
+            func(*args)
+        except Exception as e:
+            log(f"[Startup] 預熱 {name} 失敗: {e}")
+            return
+        log(f"[Startup] 預熱 {name} 完成，耗時 {time.monotonic() - started:.2f} 秒")
+
+    def submit(self, name: str, func, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="startup")
+        self._tasks[name] = self._executor.submit(self._run, name, func, *args)
+
+    def start(self):
+        if egress_pool is not None:
+            self.submit("egress", egress_pool.warm)
+        self.submit("Mailparser", warm_connection, BREAKERS["Mailparser"].session, MAILPARSER_DOWNLOAD_BASE_URL)
+        if TG_BOT_TOKEN and TG_USER_ID:
+            self.submit("Telegram", warm_connection, BREAKERS["Telegram"].session, TG_API_HOST)
+        # 只預熱最可能第一個嘗試的驗證碼引擎，其餘引擎在前一個失敗時才按需加載
+        engines = engine_selector.order(available_captcha_engines(), sample=False)
+        if engines and captcha_likely():
+            self.submit_engine(engines[0])
+
+    def submit_engine(self, engine: str):
+        if engine == "OCR.space":
+            self.submit(engine, warm_connection, BREAKERS["OCR.space"].session, "https://api.ocr.space/")
+        elif engine == "TrueCaptcha":
+            self.submit(engine, warm_connection, BREAKERS["TrueCaptcha"].session,
+                        "https://api.apitruecaptcha.org/")
+        elif engine == "ddddocr":
+            self.submit(engine, warm_ocr)
+        elif engine == "custom":
+            self.submit(engine, get_captcha_model)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+startup = StartupPipeline()
+
+def login_succeeded(text: str) -> bool:
+    return "Hello" in text or "Confirm or change your customer data here" in text
+
+def captcha_required(text: str) -> bool:
+    return "To finish the login process please solve the following captcha." in text
+
+def login_rejected(text: str) -> bool:
+    """頁面明確提示賬號或密碼錯誤；限流、會話過期等其他返回登錄表單的情況不算"""
+    return not login_succeeded(text) and LOGIN_REJECTED_TEXT.lower() in text.lower()
+
+# 本次運行中確認賬號或密碼錯誤的用戶名，login_retry 不再重試
+rejected_credentials = set()
+
+_captcha_prefetch = ThreadPoolExecutor(max_workers=2, thread_name_prefix="captcha-prefetch")
+
+def captcha_answers(solved: dict) -> List[str]:
+    """識別結果轉換為按可信度排列的待提交答案，識別失敗時返回空列表"""
+    if "error" in solved:
+        log(f"[Captcha Solver] {solved['error']}")
+        return []
+    try:
+        captcha_code = handle_captcha_solved_result(solved)
+        log(f"[Captcha Solver] 識別的驗證碼是: {captcha_code}")
+    except Exception as e:
+        log(f"[Captcha Solver] 處理驗證碼結果失敗: {e}")
+        return []
+    return [captcha_code] + [c.answer for c in solved.get("ranked", [])[1:1 + CAPTCHA_ALTERNATIVE_TRIES]]
+
 @login_retry(max_retry=LOGIN_MAX_RETRY_COUNT)
 def login(username: str, password: str) -> (str, requests.Session):
     headers = {
@@ -215,13 +1559,24 @@ def login(username: str, password: str) -> (str, requests.Session):
     }
     url = "https://support.euserv.com/index.iphp"
     captcha_image_url = "https://support.euserv.com/securimage_show.php"
-    session = requests.Session()
+    session = new_session(username)
 
     try:
-        sess = session.get(url, headers=headers, timeout=10)
+        sess = session.get(url, headers=headers, timeout=call_timeout(10))
         sess.raise_for_status()
         sess_id = re.findall("PHPSESSID=(\\w{10,100});", str(sess.headers))[0]
-        session.get("https://support.euserv.com/pic/logo_small.png", headers=headers, timeout=10)
+        speculative = None
+        if CAPTCHA_SPECULATIVE in ("prefetch", "inline"):
+            # 會話建立後即可下載驗證碼，下載和識別與後續請求並行進行；
+            # 使用複製了 cookies 的單獨會話，放棄的識別不會再使用賬號會話
+            captcha_session = new_session(username)
+            captcha_session.cookies.update(session.cookies)
+            speculative = _captcha_prefetch.submit(
+                with_deadline(captcha_solver), captcha_image_url, captcha_session, record=False
+            )
+        session.get(
+            "https://support.euserv.com/pic/logo_small.png", headers=headers, timeout=call_timeout(10)
+        )
 
         login_data = {
             "email": username.encode('utf-8', errors='replace').decode('utf-8'),
@@ -231,171 +1586,462 @@ def login(username: str, password: str) -> (str, requests.Session):
             "subaction": "login",
             "sess_id": sess_id,
         }
-        f = session.post(url, headers=headers, data=login_data, timeout=10)
+        solved, tried = None, []
+        if CAPTCHA_SPECULATIVE == "inline":
+            solved = speculative.result()
+            tried = captcha_answers(solved)
+            if tried:
+                login_data["captcha_code"] = tried[0].encode('utf-8', errors='replace').decode('utf-8')
+        f = session.post(url, headers=headers, data=login_data, timeout=call_timeout(10))
         f.raise_for_status()
 
-        if "Hello" not in f.text and "Confirm or change your customer data here" not in f.text:
-            if "To finish the login process please solve the following captcha." not in f.text:
+        if not login_succeeded(f.text):
+            if speculative is not None and captcha_required(f.text):
+                # 推測性識別的結果確實要用於驗證碼，其中失敗的引擎計入統計
+                if solved is None:
+                    solved = speculative.result()
+                record_speculative_failures(solved)
+            if login_rejected(f.text):
+                rejected_credentials.add(username)
+                log("[AutoEUServerless] 登錄失敗，賬號或密碼錯誤")
+                return "-1", session
+            if not captcha_required(f.text):
                 log("[AutoEUServerless] 登錄失敗，無驗證碼提示")
                 return "-1", session
             else:
-                log("[Captcha Solver] 正在進行驗證碼識別...")
-                solved = captcha_solver(captcha_image_url, session)
-                if "error" in solved:
-                    log(f"[Captcha Solver] {solved['error']}")
-                    return "-1", session
-                try:
-                    captcha_code = handle_captcha_solved_result(solved)
-                    log(f"[Captcha Solver] 識別的驗證碼是: {captcha_code}")
-                except Exception as e:
-                    log(f"[Captcha Solver] 處理驗證碼結果失敗: {e}")
-                    return "-1", session
-
-                f2 = session.post(
-                    url,
-                    headers=headers,
-                    data={
-                        "subaction": "login",
-                        "sess_id": sess_id,
-                        "captcha_code": captcha_code.encode('utf-8', errors='replace').decode('utf-8'),
-                    },
-                    timeout=10
-                )
-                f2.raise_for_status()
-                if "To finish the login process please solve the following captcha." not in f2.text:
-                    log("[Captcha Solver] 驗證通過")
-                    return sess_id, session
+                if tried:
+                    # 無法判斷隨登錄提交的答案是否被檢查過，在驗證碼步驟仍從最佳答案開始提交
+                    log("[Captcha Solver] 仍需要驗證碼，提交識別結果")
                 else:
+                    log("[Captcha Solver] 正在進行驗證碼識別...")
+                    solved = solved or captcha_solver(captcha_image_url, session)
+                    tried = captcha_answers(solved)
+                    if not tried:
+                        return "-1", session
+                for tries, code in enumerate(tried):
+                    if tries:
+                        log(f"[Captcha Solver] 嘗試備選驗證碼: {code}")
+                    f2 = session.post(
+                        url,
+                        headers=headers,
+                        data={
+                            "subaction": "login",
+                            "sess_id": sess_id,
+                            "captcha_code": code.encode('utf-8', errors='replace').decode('utf-8'),
+                        },
+                        timeout=call_timeout(10)
+                    )
+                    f2.raise_for_status()
+                    if not captcha_required(f2.text):
+                        log("[Captcha Solver] 驗證通過")
+                        engine_selector.record(solved["engine"], solved["latency"], True)
+                        harvest_captcha(solved.get("image"), code, tried)
+                        if login_rejected(f2.text):
+                            rejected_credentials.add(username)
+                            log("[AutoEUServerless] 登錄失敗，賬號或密碼錯誤")
+                            return "-1", session
+                        return sess_id, session
                     log("[Captcha Solver] 驗證失敗")
-
-                    return "-1", session
+                engine_selector.record(solved["engine"], solved["latency"], False)
+                harvest_captcha(solved.get("image"), None, tried)
+                return "-1", session
         else:
+            # inline 模式下無法判斷隨登錄提交的驗證碼是否被檢查過，不計入引擎統計；
+            # 不需要驗證碼時放棄尚未開始的推測性識別
+            if speculative is not None:
+                speculative.cancel()
             return sess_id, session
     except Exception as e:
         log(f"[AutoEUServerless] 登錄過程中出錯: {e}")
         return "-1", session
 
-def get_servers(sess_id: str, session: requests.Session) -> dict:
-    try:
-        d = {}
+class OrdersTableExtractor(HTMLParser):
+    """增量解析控制面板頁面，只收集訂單表格所在的容器，容器結束即停止"""
+
+    def __init__(self, container_id: str = ORDERS_CONTAINER_ID):
+        super().__init__(convert_charrefs=False)
+        self.container_id = container_id
+        self.container_tag = None
+        self.done = False
+        self._depth = 0
+        self._parts = []
+
+    @property
+    def fragment(self) -> str:
+        return "".join(self._parts)
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if self.container_tag is None:
+            if dict(attrs).get("id") != self.container_id:
+                return
+            self.container_tag = tag
+        if tag == self.container_tag:
+            self._depth += 1
+        self._parts.append(self.get_starttag_text())
+
+    def handle_startendtag(self, tag, attrs):
+        if self.container_tag is not None and not self.done:
+            self._parts.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self.container_tag is None or self.done:
+            return
+        self._parts.append(f"</{tag}>")
+        if tag == self.container_tag:
+            self._depth -= 1
+            if self._depth == 0:
+                self.done = True
+
+    def handle_data(self, data):
+        if self.container_tag is not None and not self.done:
+            self._parts.append(data)
+
+    def handle_entityref(self, name):
+        self.handle_data(f"&{name};")
+
+    def handle_charref(self, name):
+        self.handle_data(f"&#{name};")
+
+class Order(NamedTuple):
+    order_id: str
+    product: str
+    status: str
+    contract_end: Optional[date]
+    extension_possible_from: Optional[date]
+    renewable: bool
+
+_DATE_PATTERN = r"(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}\.\d{1,2}\.\d{4})"
+_EXTENSION_RE = re.compile(r"Contract extension possible from\W*" + _DATE_PATTERN, re.I)
+_CONTRACT_END_RE = re.compile(
+    r"(?:contract end|end of contract|contract term ends|valid until|paid until|expires?)\W*"
+    + _DATE_PATTERN, re.I
+)
+
+def _parse_date(text: str) -> Optional[date]:
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def parse_orders(html: str) -> Dict[str, Order]:
+    """解析訂單表格，一次得到每個訂單的產品、狀態、合約到期日和可續期日期"""
+    orders = {}
+    soup = BeautifulSoup(html, "html.parser")
+    for tr in soup.select(
+        f"#{ORDERS_CONTAINER_ID} .kc2_order_table.kc2_content_table tr"
+    ):
+        server_id = tr.select(".td-z1-sp1-kc")
+        if not len(server_id) == 1:
+            continue
+        order_id = server_id[0].get_text(strip=True).encode('utf-8', errors='replace').decode('utf-8')
+        action = tr.select(".td-z1-sp2-kc .kc2_order_action_container")[0]
+        status = " ".join(action.get_text(" ").split())
+        if not status:
+            # 可續期時容器裡通常只有按鈕，用按鈕文字作為狀態
+            status = " ".join(el.get("value", "") for el in action.select("input, button")).strip()
+        product_cell = tr.select_one(".td-z1-sp2-kc")
+        product = ""
+        for text in product_cell.find_all(string=True):
+            if action not in text.parents and text.strip():
+                product = " ".join(text.split())
+                break
+        row_text = " ".join(tr.get_text(" ").split())
+        extension = _EXTENSION_RE.search(status)
+        contract_end = _CONTRACT_END_RE.search(row_text)
+        orders[order_id] = Order(
+            order_id=order_id,
+            product=product,
+            status=status,
+            contract_end=_parse_date(contract_end.group(1)) if contract_end else None,
+            extension_possible_from=_parse_date(extension.group(1)) if extension else None,
+            renewable=status.find("Contract extension possible from") == -1,
+        )
+    return orders
+
+def get_orders(sess_id: str, session: requests.Session, quiet: bool = False) -> Dict[str, Order]:
+    try:
         url = f"https://support.euserv.com/index.iphp?sess_id={sess_id}"
         headers = {
             "user-agent": user_agent,
             "origin": "https://www.euserv.com",
-            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8"
+            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+            # 只聲明 urllib3 能解碼的壓縮格式（安裝 brotli 後包含 br）
+            "Accept-Encoding": ACCEPT_ENCODING,
         }
-        f = session.get(url=url, headers=headers, timeout=10)
-        f.raise_for_status()
-        soup = BeautifulSoup(f.text.encode('utf-8', errors='replace').decode('utf-8'), "html.parser")
+        extractor = OrdersTableExtractor()
+        # 流式讀取，訂單表格讀完後立即關閉連接，不再下載頁面剩餘部分
+        with session.get(url=url, headers=headers, timeout=call_timeout(10), stream=True) as f:
+            f.raise_for_status()
+            decoder = codecs.getincrementaldecoder(f.encoding or "utf-8")(errors="replace")
+            for chunk in f.iter_content(chunk_size=PAGE_CHUNK_SIZE):
+                extractor.feed(decoder.decode(chunk))
+                if extractor.done:
+                    break
+            else:
+                extractor.feed(decoder.decode(b"", final=True))
         # 檢查 HTML 結構
-        if not soup.select("#kc2_order_customer_orders_tab_content_1"):
-            log("[AutoEUServerless] HTML 結構變化，無法找到訂單表格")
+        if extractor.container_tag is None:
+            # quiet 用於探測會話是否仍然有效，會話失效時頁面同樣沒有訂單表格
+            if not quiet:
+                log("[AutoEUServerless] HTML 結構變化，無法找到訂單表格")
             return {}
-        for tr in soup.select(
-            "#kc2_order_customer_orders_tab_content_1 .kc2_order_table.kc2_content_table tr"
-        ):
-            server_id = tr.select(".td-z1-sp1-kc")
-            if not len(server_id) == 1:
-                continue
-            flag = (
-                True
-                if tr.select(".td-z1-sp2-kc .kc2_order_action_container")[0]
-                .get_text()
-                .find("Contract extension possible from")
-                == -1
-                else False
-            )
-            d[server_id[0].get_text().encode('utf-8', errors='replace').decode('utf-8')] = flag
-        return d
+        return parse_orders(extractor.fragment)
     except Exception as e:
         log(f"[AutoEUServerless] 獲取服務器列表失敗: {e}")
         return {}
 
-def renew(
-    sess_id: str, session: requests.Session, password: str, order_id: str, mailparser_dl_url_id: str
-) -> bool:
-    url = "https://support.euserv.com/index.iphp"
-    headers = {
-        "user-agent": user_agent,
-        "Host": "support.euserv.com",
-        "origin": "https://www.euserv.com",
-        "Referer": "https://support.euserv.com/index.iphp",
-        "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
-    }
-    try:
-        # 選擇續期訂單
-        data = {
-            "Submit": "Extend contract",
-            "sess_id": sess_id,
-            "ord_no": order_id,
-            "subaction": "choose_order",
-            "choose_order_subaction": "show_contract_details",
-        }
-        response = session.post(url, headers=headers, data=data, timeout=10)
-        response.raise_for_status()
+def get_servers(sess_id: str, session: requests.Session) -> dict:
+    """兼容舊接口：{訂單號: 是否可續期}"""
+    return {order_id: order.renewable for order_id, order in get_orders(sess_id, session).items()}
 
-        # 觸發 PIN 發送
-        response = session.post(
-            url,
-            headers=headers,
-            data={
-                "sess_id": sess_id,
-                "subaction": "show_kc2_security_password_dialog",
-                "prefix": "kc2_customer_contract_details_extend_contract_",
-                "type": "1",
-            },
-            timeout=10
-        )
-        response.raise_for_status()
+RENEW_URL = "https://support.euserv.com/index.iphp"
+RENEW_HEADERS = {
+    "user-agent": user_agent,
+    "Host": "support.euserv.com",
+    "origin": "https://www.euserv.com",
+    "Referer": "https://support.euserv.com/index.iphp",
+    "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+}
+
+def _write_state_file(path: str, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+    os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, path)
+
+def account_key(username: str) -> str:
+    return hashlib.sha1(username.encode('utf-8')).hexdigest()[:12]
 
-        # 等待並獲取 PIN
-        time.sleep(WAITING_TIME_OF_PIN)
+class RenewalCheckpoint:
+    """續期狀態機的斷點，每次狀態轉移後連同會話 cookies 寫入磁盤"""
+
+    def __init__(self, path: Optional[str], order_id: str, sess_id: str,
+                 state: Optional[str] = None, pin: str = "", token: str = "",
+                 cookies: Optional[list] = None, updated_at: float = 0.0):
+        self.path = path
+        self.order_id = order_id
+        self.sess_id = sess_id
+        self.state = state
+        self.pin = pin
+        self.token = token
+        self.cookies = cookies or []
+        self.updated_at = updated_at
+        # 賬號郵箱只保存在內存中，用於在共用收件箱中匹配 PIN
+        self.receiver = None
+
+    @classmethod
+    def new(cls, username: str, order_id: str, sess_id: str) -> "RenewalCheckpoint":
+        path = os.path.join(STATE_DIR, f"checkpoint-{account_key(username)}-{order_id}.json")
+        checkpoint = cls(path, order_id, sess_id)
+        checkpoint.receiver = username
+        return checkpoint
+
+    @classmethod
+    def load(cls, path: str) -> Optional["RenewalCheckpoint"]:
         try:
-            pin = get_pin_from_mailparser(mailparser_dl_url_id)
-            log(f"[MailParser] PIN: {pin}")
-        except Exception as e:
-            log(f"[MailParser] PIN 獲取失敗: {e}")
-            return False
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            return cls(path, **data)
+        except (OSError, ValueError, TypeError):
+            return None
 
-        # 使用 PIN 獲取 token
-        data = {
-            "auth": pin.encode('utf-8', errors='replace').decode('utf-8'),
-            "sess_id": sess_id,
-            "subaction": "kc2_security_password_get_token",
+    def is_stale(self) -> bool:
+        return clock.time() - self.updated_at > RENEW_CHECKPOINT_TTL
+
+    def advance(self, state: str, session: requests.Session):
+        self.state = state
+        self.updated_at = clock.time()
+        self.cookies = [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path}
+            for c in session.cookies
+        ]
+        if self.path:
+            try:
+                _write_state_file(self.path, {
+                    "order_id": self.order_id,
+                    "sess_id": self.sess_id,
+                    "state": self.state,
+                    "token": self.token,
+                    "cookies": self.cookies,
+                    "updated_at": self.updated_at,
+                })
+            except OSError as e:
+                # 斷點只是加速恢復，狀態目錄不可寫時在內存中繼續續期
+                log(f"[AutoEUServerless] ServerID: {self.order_id} 斷點保存失敗，本次續期不再保存斷點: {e}")
+                self.path = None
+
+    def discard(self):
+        try:
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)
+        except OSError as e:
+            log(f"[AutoEUServerless] ServerID: {self.order_id} 斷點刪除失敗: {e}")
+
+    def restore_session(self, session: requests.Session) -> requests.Session:
+        for c in self.cookies:
+            session.cookies.set(c["name"], c["value"], domain=c["domain"], path=c["path"])
+        return session
+
+def load_checkpoints(username: str) -> List[RenewalCheckpoint]:
+    """讀取賬號未完成的續期斷點，過期的直接刪除"""
+    prefix = f"checkpoint-{account_key(username)}-"
+    checkpoints = []
+    if not os.path.isdir(STATE_DIR):
+        return checkpoints
+    for name in sorted(os.listdir(STATE_DIR)):
+        if not (name.startswith(prefix) and name.endswith(".json")):
+            continue
+        checkpoint = RenewalCheckpoint.load(os.path.join(STATE_DIR, name))
+        if checkpoint is None or checkpoint.is_stale():
+            os.remove(os.path.join(STATE_DIR, name))
+            continue
+        checkpoint.receiver = username
+        checkpoints.append(checkpoint)
+    return checkpoints
+
+def _renew_choose_order(
+    cp: RenewalCheckpoint, session: requests.Session, mailparser_dl_url_id: str
+) -> bool:
+    data = {
+        "Submit": "Extend contract",
+        "sess_id": cp.sess_id,
+        "ord_no": cp.order_id,
+        "subaction": "choose_order",
+        "choose_order_subaction": "show_contract_details",
+    }
+    response = session.post(RENEW_URL, headers=RENEW_HEADERS, data=data, timeout=call_timeout(10))
+    response.raise_for_status()
+    return True
+
+def _renew_request_pin(
+    cp: RenewalCheckpoint, session: requests.Session, mailparser_dl_url_id: str
+) -> bool:
+    # 彈出安全檢查對話框會自動發送 PIN 郵件，並使之前的 PIN 失效
+    if cp.receiver and not leases.still_held(cp.receiver):
+        log(f"[Lease] ServerID: {cp.order_id} 的賬號已由其他運行處理，不再申請 PIN")
+        return False
+    response = session.post(
+        RENEW_URL,
+        headers=RENEW_HEADERS,
+        data={
+            "sess_id": cp.sess_id,
+            "subaction": "show_kc2_security_password_dialog",
             "prefix": "kc2_customer_contract_details_extend_contract_",
             "type": "1",
-            "ident": f"kc2_customer_contract_details_extend_contract_{order_id}",
-        }
-        response = session.post(url, headers=headers, data=data, timeout=10)
-        response.raise_for_status()
-        response_data = json.loads(response.text.encode('utf-8', errors='replace').decode('utf-8'))
-        if response_data.get("rs") != "success":
-            log(f"[AutoEUServerless] token 獲取失敗: {response_data}")
-            return False
-        token = response_data["token"]["value"]
+        },
+        timeout=call_timeout(10)
+    )
+    response.raise_for_status()
+    return True
 
-        # 提交續期請求
-        data = {
-            "sess_id": sess_id,
-            "ord_id": order_id,
-            "subaction": "kc2_customer_contract_details_extend_contract_term",
-            "token": token,
-        }
-        response = session.post(url, headers=headers, data=data, timeout=10)
-        response.raise_for_status()
-        log(f"[AutoEUServerless] 續期請求響應: {response.text[:200]}")  # 記錄部分響應內容
+def _renew_receive_pin(
+    cp: RenewalCheckpoint, session: requests.Session, mailparser_dl_url_id: str
+) -> bool:
+    # 斷點恢復時 PIN 郵件可能早已到達，只等待剩餘的時間
+    wait(max(WAITING_TIME_OF_PIN - (clock.time() - cp.updated_at), 0))
+    try:
+        # pin_requested 狀態的更新時間即 PIN 郵件的發送時間
+        cp.pin = get_pin_from_mailparser(mailparser_dl_url_id, cp.receiver, cp.updated_at)
+        log(f"[MailParser] PIN: {cp.pin}")
+        return True
+    except Exception as e:
+        log(f"[MailParser] PIN 獲取失敗: {e}")
+        return False
 
-        # 增加等待時間，確保續期生效
-        time.sleep(10)
+def _renew_get_token(
+    cp: RenewalCheckpoint, session: requests.Session, mailparser_dl_url_id: str
+) -> bool:
+    data = {
+        "auth": cp.pin.encode('utf-8', errors='replace').decode('utf-8'),
+        "sess_id": cp.sess_id,
+        "subaction": "kc2_security_password_get_token",
+        "prefix": "kc2_customer_contract_details_extend_contract_",
+        "type": "1",
+        "ident": f"kc2_customer_contract_details_extend_contract_{cp.order_id}",
+    }
+    response = session.post(RENEW_URL, headers=RENEW_HEADERS, data=data, timeout=call_timeout(10))
+    response.raise_for_status()
+    response_data = json.loads(response.text.encode('utf-8', errors='replace').decode('utf-8'))
+    if response_data.get("rs") != "success":
+        log(f"[AutoEUServerless] token 獲取失敗: {response_data}")
+        # PIN 無效，下次需要重新申請
+        cp.discard()
+        return False
+    cp.token = response_data["token"]["value"]
+    return True
 
-        # 驗證續期是否成功
-        servers = get_servers(sess_id, session)
-        if order_id in servers and not servers[order_id]:
-            log(f"[AutoEUServerless] ServerID: {order_id} 已成功續訂!")
-            return True
-        else:
-            log(f"[AutoEUServerless] ServerID: {order_id} 續訂未生效!")
-            return False
+def _renew_submit(
+    cp: RenewalCheckpoint, session: requests.Session, mailparser_dl_url_id: str
+) -> bool:
+    data = {
+        "sess_id": cp.sess_id,
+        "ord_id": cp.order_id,
+        "subaction": "kc2_customer_contract_details_extend_contract_term",
+        "token": cp.token,
+    }
+    response = session.post(RENEW_URL, headers=RENEW_HEADERS, data=data, timeout=call_timeout(10))
+    response.raise_for_status()
+    log(f"[AutoEUServerless] 續期請求響應: {response.text[:200]}")  # 記錄部分響應內容
+    return True
+
+def _renew_verify(
+    cp: RenewalCheckpoint, session: requests.Session, mailparser_dl_url_id: str
+) -> bool:
+    # 增加等待時間，確保續期生效
+    wait(max(10 - (clock.time() - cp.updated_at), 0))
+    servers = get_servers(cp.sess_id, session)
+    if cp.order_id in servers and not servers[cp.order_id]:
+        log(f"[AutoEUServerless] ServerID: {cp.order_id} 已成功續訂!")
+        return True
+    log(f"[AutoEUServerless] ServerID: {cp.order_id} 續訂未生效!")
+    return False
+
+# 續期狀態機：每一步成功後進入對應狀態並寫入斷點
+RENEW_STEPS = (
+    ("choose_order", _renew_choose_order),
+    ("pin_requested", _renew_request_pin),
+    ("pin_received", _renew_receive_pin),
+    ("token", _renew_get_token),
+    ("submitted", _renew_submit),
+    ("verified", _renew_verify),
+)
+
+# 進度消息中顯示的各步驟說明
+RENEW_PHASES = {
+    "choose_order": "選擇訂單",
+    "pin_requested": "申請 PIN",
+    "pin_received": "等待 PIN",
+    "token": "獲取 token",
+    "submitted": "提交續期",
+    "verified": "驗證續期結果",
+}
+
+def renew(
+    sess_id: str, session: requests.Session, password: str, order_id: str, mailparser_dl_url_id: str,
+    checkpoint: Optional[RenewalCheckpoint] = None
+) -> bool:
+    cp = checkpoint or RenewalCheckpoint(None, order_id, sess_id)
+    if cp.state == "pin_received" and not cp.pin:
+        # PIN 只保存在內存中，斷點恢復時重新申請
+        cp.state = "choose_order"
+    states = [state for state, _ in RENEW_STEPS]
+    start = states.index(cp.state) + 1 if cp.state in states else 0
+    if start:
+        log(f"[AutoEUServerless] ServerID: {order_id} 從斷點 {cp.state} 恢復續期")
+    try:
+        for state, step in RENEW_STEPS[start:]:
+            progress.phase(f"續期 {order_id}: {RENEW_PHASES[state]}")
+            if not step(cp, session, mailparser_dl_url_id):
+                return False
+            cp.advance(state, session)
+        cp.discard()
+        return True
     except UnicodeEncodeError as e:
         log(f"[AutoEUServerless] 編碼錯誤: {e}")
         return False
@@ -422,6 +2068,102 @@ def check(sess_id: str, session: requests.Session):
     except Exception as e:
         log(f"[AutoEUServerless] 檢查狀態失敗: {e}")
 
+class ProgressReporter:
+    """在 Telegram 上發送一條進度消息，之後按節流間隔用 editMessageText 更新"""
+
+    def __init__(self, interval: float = TG_PROGRESS_INTERVAL):
+        self.interval = interval
+        self.message_id = None
+        self._accounts = {}
+        self._started = 0.0
+        self._last_text = ""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.message_id is not None
+
+    def _call(self, method: str, data: dict) -> dict:
+        response = BREAKERS["Telegram progress"].request(
+            "POST", f"{TG_API_HOST}/bot{TG_BOT_TOKEN}/{method}", data=data, timeout=10
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _render(self) -> str:
+        now = time.monotonic()
+        lines = ["<b>AutoEUServerless 進度</b>", ""]
+        with self._lock:
+            for index, (phase, since) in sorted(self._accounts.items()):
+                lines.append(f"賬號 {index + 1}: {phase} ({now - since:.0f}s)")
+        lines.append("")
+        lines.append(f"已運行 {now - self._started:.0f}s")
+        return "\n".join(lines)
+
+    def _edit(self, text: str):
+        if text == self._last_text:
+            return
+        try:
+            self._call("editMessageText", {
+                "chat_id": TG_USER_ID,
+                "message_id": self.message_id,
+                "text": text,
+                "parse_mode": "HTML",
+            })
+            self._last_text = text
+        except CircuitOpenError:
+            # 熔斷時熔斷器已記錄日誌，不在每次編輯時重複
+            pass
+        except Exception as e:
+            log(f"Telegram 進度更新失敗: {e}")
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._edit(self._render())
+
+    def start(self, accounts: Sequence[int]):
+        if not (TG_PROGRESS and TG_BOT_TOKEN and TG_USER_ID):
+            return
+        self._started = time.monotonic()
+        self._accounts = {i: ("等待中", self._started) for i in accounts}
+        text = self._render()
+        try:
+            result = self._call("sendMessage", {"chat_id": TG_USER_ID, "text": text, "parse_mode": "HTML"})
+            self.message_id = result["result"]["message_id"]
+            self._last_text = text
+        except Exception as e:
+            log(f"Telegram 進度消息發送失敗: {e}")
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def begin_account(self, index: int):
+        self._local.account = index
+        self.phase("開始")
+
+    def phase(self, text: str):
+        """更新當前線程所處理賬號的階段，實際編輯由後台線程按間隔完成"""
+        index = getattr(self._local, "account", None)
+        if index is None or not self.enabled:
+            return
+        with self._lock:
+            self._accounts[index] = (text, time.monotonic())
+
+    def finish(self, summary: str):
+        if not self.enabled:
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._edit(self._render() + "\n" + summary)
+        self.message_id = None
+
+progress = ProgressReporter()
+
 def telegram():
     message = (
         "<b>AutoEUServerless 日誌</b>\n\n" + desp +
@@ -436,6 +2178,13 @@ def telegram():
         "⭐️ 給我們一個 GitHub Star! ⭐️\n"
         "<a href='https://github.com/WizisCool/AutoEUServerless'>訪問 GitHub 項目</a>"
     )
+    try:
+        send_telegram(message)
+        log("Telegram Bot 推送成功")
+    except Exception as e:
+        log(f"Telegram Bot 推送失敗: {e}")
+
+def send_telegram(message: str):
     message = message.encode('utf-8', errors='replace').decode('utf-8')
     data = {
         "chat_id": TG_USER_ID,
@@ -443,16 +2192,478 @@ def telegram():
         "parse_mode": "HTML",
         "disable_web_page_preview": "true"
     }
-    try:
-        response = requests.post(
-            TG_API_HOST + "/bot" + TG_BOT_TOKEN + "/sendMessage", data=data, timeout=10
+    response = BREAKERS["Telegram"].request(
+        "POST", TG_API_HOST + "/bot" + TG_BOT_TOKEN + "/sendMessage", data=data,
+        timeout=call_timeout(10)
+    )
+    response.raise_for_status()
+
+def parse_duration(text: str) -> timedelta:
+    """解析 30m、12h、3d、1w 這樣的時長"""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*", text.lower())
+    if not match:
+        raise ValueError(f"無效的時長: {text}")
+    unit = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks", "": "days"}[match.group(2)]
+    return timedelta(**{unit: float(match.group(1))})
+
+class RunHistory:
+    """上次運行的結果：每個賬號（以哈希為鍵）的狀態和各訂單的續期結果、日期"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.accounts = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self.accounts = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def get(self, username: str) -> Optional[dict]:
+        return self.accounts.get(account_key(username))
+
+    def record(self, username: str, status: str, orders: Optional[Dict[str, Order]] = None,
+               results: Optional[Dict[str, bool]] = None):
+        """記錄賬號結果並立即保存；orders 為空時保留上次記錄的訂單信息"""
+        entry = self.accounts.get(account_key(username), {})
+        known = entry.get("orders", {})
+        if orders:
+            known = {
+                order_id: {
+                    "status": known.get(order_id, {}).get("status", "ok"),
+                    # 與讀回的 JSON 一致保存為字符串，機器人模式下同一進程會再次讀取
+                    "contract_end": order.contract_end and order.contract_end.isoformat(),
+                    "extension_possible_from": order.extension_possible_from and order.extension_possible_from.isoformat(),
+                    "renewable": order.renewable,
+                }
+                for order_id, order in orders.items()
+            }
+        for order_id, renewed in (results or {}).items():
+            known.setdefault(order_id, {})["status"] = "ok" if renewed else "failed"
+            if renewed:
+                # 續期前的日期已經過時，清除後調度和 --due-within 不會把剛續期的訂單當作到期
+                known[order_id].update(renewable=False, contract_end=None, extension_possible_from=None)
+        entry.update(status=status, orders=known, updated_at=clock.time())
+        self.accounts[account_key(username)] = entry
+        self._save()
+
+    def record_duration(self, username: str, seconds: float):
+        """以指數移動平均記錄處理一個賬號的耗時，供調度估算"""
+        entry = self.accounts.setdefault(account_key(username), {"status": "failed", "orders": {}})
+        previous = entry.get("duration")
+        entry["duration"] = seconds if previous is None else (
+            (1 - SCHEDULE_DURATION_WEIGHT) * previous + SCHEDULE_DURATION_WEIGHT * seconds
         )
-        response.raise_for_status()
-        log("Telegram Bot 推送成功")
+        self._save()
+
+    def _save(self):
+        if self.path:
+            try:
+                _write_state_file(self.path, self.accounts)
+            except OSError as e:
+                log(f"[AutoEUServerless] 運行記錄保存失敗: {e}")
+
+run_history = RunHistory(os.path.join(STATE_DIR, "last_run.json"))
+
+def _record_due(record: dict, horizon: date) -> bool:
+    if record.get("renewable"):
+        return True
+    for key in ("extension_possible_from", "contract_end"):
+        day = _parse_date(record.get(key) or "")
+        if day is not None and day <= horizon:
+            return True
+    return False
+
+class RunSelection:
+    """命令行選擇器：只處理匹配的賬號和訂單，不匹配的賬號不登錄"""
+
+    def __init__(self, accounts: Sequence[str] = (), orders: Sequence[str] = (),
+                 only_failed: bool = False, due_within: Optional[timedelta] = None,
+                 history: Optional[RunHistory] = None):
+        self.accounts = set(accounts)
+        self.orders = set(orders)
+        self.only_failed = only_failed
+        self.due_within = due_within
+        self.history = history or run_history
+
+    @classmethod
+    def from_args(cls, args) -> "RunSelection":
+        return cls(
+            accounts=args.account or (),
+            orders=args.order or (),
+            only_failed=args.only_failed_last_run,
+            due_within=parse_duration(args.due_within) if args.due_within else None,
+        )
+
+    @property
+    def everything(self) -> bool:
+        return not (self.accounts or self.orders or self.only_failed or self.due_within)
+
+    def _horizon(self) -> date:
+        return datetime.fromtimestamp(clock.time()).date() + self.due_within
+
+    def select_account(self, index: int, username: str) -> bool:
+        """按上次運行記錄判斷賬號是否可能有匹配的訂單；沒有記錄時只能登錄後再篩選"""
+        if self.accounts and username not in self.accounts and str(index + 1) not in self.accounts:
+            return False
+        record = self.history.get(username)
+        if self.only_failed and (record is None or record["status"] == "ok"):
+            return False
+        if record is None or not record.get("orders") or load_checkpoints(username):
+            return True
+        if self.orders and not self.orders & set(record["orders"]):
+            return False
+        if self.due_within and not any(_record_due(o, self._horizon()) for o in record["orders"].values()):
+            return False
+        return True
+
+    def select_order(self, username: str, order: Order) -> bool:
+        if self.orders and order.order_id not in self.orders:
+            return False
+        if self.only_failed:
+            record = self.history.get(username) or {}
+            if record.get("orders", {}).get(order.order_id, {}).get("status") == "ok" \
+                    and record.get("status") not in ("login_failed", "deferred", "bad_credentials"):
+                return False
+        if self.due_within and not order.renewable:
+            horizon = self._horizon()
+            return any(d is not None and d <= horizon for d in (order.extension_possible_from, order.contract_end))
+        return True
+
+def _order_need_by(record: dict, today: date) -> Optional[date]:
+    """訂單最晚需要在哪天續期；現在無法續期（可續期日期未到）時返回 None"""
+    eligible_from = _parse_date(record.get("extension_possible_from") or "")
+    if not (record.get("renewable") or record.get("status") == "failed"
+            or (eligible_from is not None and eligible_from <= today)):
+        return None
+    return _parse_date(record.get("contract_end") or "") or today
+
+class RenewalScheduler:
+    """按上次運行記錄的訂單日期排列賬號：合同最早結束的可續期訂單優先，
+    時間預算不足以處理一個賬號時，推遲所有訂單都能等到下次運行的賬號"""
+
+    def __init__(self, history: RunHistory):
+        self.history = history
+        self.today = datetime.fromtimestamp(clock.time()).date()
+
+    def need_by(self, username: str) -> date:
+        # 沒有記錄的賬號無法判斷，與今天到期同等對待；有中斷的續期時最優先
+        if load_checkpoints(username):
+            return date.min
+        record = self.history.get(username)
+        if record is None or not record.get("orders"):
+            return self.today
+        days = [_order_need_by(o, self.today) for o in record["orders"].values()]
+        return min((d for d in days if d is not None), default=date.max)
+
+    def order(self, accounts: Sequence[Tuple[str, str, str]], selected: Sequence[int]) -> List[int]:
+        if SCHEDULE != "priority":
+            return list(selected)
+        return sorted(selected, key=lambda i: (self.need_by(accounts[i][0]), i))
+
+    def expected_duration(self, username: str) -> float:
+        return (self.history.get(username) or {}).get("duration") or SCHEDULE_DEFAULT_DURATION
+
+    def can_defer(self, username: str, deadline: Deadline) -> bool:
+        """剩餘預算不夠處理該賬號，且它的訂單都能安全等到下次運行"""
+        remaining = deadline.remaining()
+        if SCHEDULE != "priority" or remaining is None or remaining >= self.expected_duration(username):
+            return False
+        return self.need_by(username) > self.today + timedelta(days=SCHEDULE_SAFE_DAYS)
+
+def order_urgency(order: Order) -> tuple:
+    """同一賬號內先續期合同最早結束的訂單"""
+    return not order.renewable, order.contract_end or date.max, order.order_id
+
+class LeaseStore:
+    """STATE_DIR 中 SQLite 數據庫保存的賬號租約。同一賬號同時只有一個運行在處理，
+    否則各自申請的 PIN 會互相作廢。持有者在後台線程中續約，崩潰後租約自然過期"""
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{random.getrandbits(32):08x}"
+        self.held = set()
+        # 心跳發現已被其他運行取得的租約，申請 PIN 之前檢查
+        self.lost = set()
+        self._lock = threading.Lock()
+        self._stop = None
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases "
+            "(account TEXT PRIMARY KEY, owner TEXT NOT NULL, acquired_at REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+        return conn
+
+    def acquire(self, username: str) -> Optional[Tuple[str, float]]:
+        """取得租約時返回 None，否則返回當前持有者和租約的過期時間"""
+        key = account_key(username)
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE 取得寫鎖，讀取和寫入之間不會有其他進程插入
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT owner, expires_at FROM leases WHERE account = ?", (key,)).fetchone()
+            now = clock.time()
+            if row is not None and row[0] != self.owner and row[1] > now:
+                conn.execute("ROLLBACK")
+                return row
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (account, owner, acquired_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, self.owner, now, now + self.ttl),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        with self._lock:
+            self.held.add(key)
+            self.lost.discard(key)
+            if self._stop is None:
+                # 每個心跳線程有自己的停止事件，釋放最後一個租約後退出
+                self._stop = threading.Event()
+                threading.Thread(
+                    target=self._renew_loop, args=(self._stop,), name="lease-heartbeat", daemon=True
+                ).start()
+        return None
+
+    def release(self, username: str):
+        key = account_key(username)
+        with self._lock:
+            if key not in self.held and key not in self.lost:
+                # 沒有取得過租約（如租約數據庫不可用），不訪問數據庫
+                return
+            self.held.discard(key)
+            self.lost.discard(key)
+            if not self.held and self._stop is not None:
+                self._stop.set()
+                self._stop = None
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM leases WHERE account = ? AND owner = ?", (key, self.owner))
+        finally:
+            conn.close()
+
+    def still_held(self, username: str) -> bool:
+        """租約已被其他運行取得時返回 False；沒有取得過租約的賬號（如 ACCOUNT_LEASE=off）總是返回 True"""
+        key = account_key(username)
+        with self._lock:
+            if key in self.lost:
+                return False
+            if key not in self.held:
+                return True
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT owner FROM leases WHERE account = ?", (key,)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            log(f"[Lease] 無法檢查賬號租約: {e}")
+            return True
+        if row is not None and row[0] == self.owner:
+            return True
+        self._mark_lost(key)
+        return False
+
+    def _mark_lost(self, key: str):
+        with self._lock:
+            if key not in self.held:
+                return
+            self.held.discard(key)
+            self.lost.add(key)
+        log(f"[Lease] 賬號租約 {key} 已被其他運行取得")
+
+    def _renew_loop(self, stop: threading.Event):
+        # 心跳按真實時間間隔，過期時間仍用全局時鐘計算
+        while not stop.wait(self.ttl / 3):
+            with self._lock:
+                held = list(self.held)
+            if not held:
+                continue
+            try:
+                conn = self._connect()
+                try:
+                    for key in held:
+                        updated = conn.execute(
+                            "UPDATE leases SET expires_at = ? WHERE account = ? AND owner = ?",
+                            (clock.time() + self.ttl, key, self.owner),
+                        ).rowcount
+                        if not updated:
+                            self._mark_lost(key)
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                log(f"[Lease] 賬號租約續約失敗: {e}")
+
+leases = LeaseStore(os.path.join(STATE_DIR, "leases.db"), ACCOUNT_LEASE_TTL)
+
+def acquire_lease(i: int, username: str) -> bool:
+    """按 ACCOUNT_LEASE 取得賬號租約，返回是否可以處理該賬號"""
+    if ACCOUNT_LEASE == "off":
+        return True
+    waited = 0.0
+    while True:
+        try:
+            holder = leases.acquire(username)
+        except (sqlite3.Error, OSError) as e:
+            # 狀態目錄不可寫（如只讀文件系統）時不使用租約，與關閉租約時一樣處理
+            log(f"[Lease] 無法使用租約數據庫，直接處理第 {i + 1} 個賬號: {e}")
+            return True
+        if holder is None:
+            return True
+        progress.begin_account(i)
+        if ACCOUNT_LEASE != "wait" or waited >= ACCOUNT_LEASE_WAIT:
+            log(f"[Lease] 第 {i + 1} 個賬號正由 {holder[0]} 處理，已跳過")
+            progress.phase("⏭️ 其他運行處理中")
+            return False
+        if waited == 0:
+            log(f"[Lease] 第 {i + 1} 個賬號正由 {holder[0]} 處理，等待其完成")
+        progress.phase("等待其他運行")
+        wait(ACCOUNT_LEASE_POLL)
+        waited += ACCOUNT_LEASE_POLL
+
+def release_lease(username: str):
+    if ACCOUNT_LEASE == "off":
+        return
+    try:
+        leases.release(username)
+    except (sqlite3.Error, OSError) as e:
+        log(f"[Lease] 賬號租約釋放失敗，將在 {ACCOUNT_LEASE_TTL:.0f} 秒後過期: {e}")
+
+# 每個賬號已登錄的會話 {用戶名: (sess_id, 會話)}，來自預檢或機器人模式下的上一次續期
+warm_sessions: Dict[str, Tuple[str, requests.Session]] = {}
+
+def preflight_account(username: str, password: str) -> str:
+    """不識別驗證碼的登錄探測：ok 已登錄（會話放入 warm_sessions），captcha 需要驗證碼（賬號密碼尚未檢查），
+    bad_credentials 賬號或密碼錯誤，unknown 無法判斷"""
+    if load_checkpoints(username):
+        return "ok"
+    if username in warm_sessions:
+        sess_id, session = warm_sessions[username]
+        if get_orders(sess_id, session, quiet=True):
+            return "ok"
+        del warm_sessions[username]
+    url = "https://support.euserv.com/index.iphp"
+    headers = {
+        "user-agent": user_agent,
+        "origin": "https://www.euserv.com",
+        "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8"
+    }
+    session = new_session(username)
+    try:
+        sess = session.get(url, headers=headers, timeout=call_timeout(10))
+        sess.raise_for_status()
+        sess_id = re.findall("PHPSESSID=(\\w{10,100});", str(sess.headers))[0]
+        f = session.post(url, headers=headers, timeout=call_timeout(10), data={
+            "email": username.encode('utf-8', errors='replace').decode('utf-8'),
+            "password": password.encode('utf-8', errors='replace').decode('utf-8'),
+            "form_selected_language": "en",
+            "Submit": "Login",
+            "subaction": "login",
+            "sess_id": sess_id,
+        })
+        f.raise_for_status()
     except Exception as e:
-        log(f"Telegram Bot 推送失敗: {e}")
+        log(f"[AutoEUServerless] 登錄預檢出錯: {e}")
+        return "unknown"
+    if login_succeeded(f.text):
+        warm_sessions[username] = (sess_id, session)
+        return "ok"
+    if captcha_required(f.text):
+        return "captcha"
+    if login_rejected(f.text):
+        rejected_credentials.add(username)
+        return "bad_credentials"
+    return "unknown"
 
-def main_handler(event, context):
+def preflight(accounts: Sequence[Tuple[str, str, str]], selected: Sequence[int], history: RunHistory,
+              deadline: Deadline) -> List[int]:
+    """並發預檢所選賬號，返回可以進入續期階段的賬號"""
+    with ThreadPoolExecutor(max_workers=max(1, min(PREFLIGHT_CONCURRENCY, len(selected)))) as executor:
+        states = list(executor.map(
+            with_deadline(lambda i: preflight_account(*accounts[i][:2]), deadline), selected
+        ))
+    usable = []
+    for i, state in zip(selected, states):
+        if state == "bad_credentials":
+            log(f"[AutoEUServerless] 第 {i + 1} 個賬號的賬號或密碼錯誤，已排除，請檢查登錄資訊")
+            history.record(accounts[i][0], "bad_credentials")
+            continue
+        usable.append(i)
+    summary = ", ".join(f"{state} {states.count(state)}" for state in sorted(set(states)))
+    log(f"[AutoEUServerless] 登錄預檢完成: {summary}")
+    return usable
+
+def renew_account(i: int, username: str, password: str, mailparser_dl_url_id: str,
+                  selection: Optional[RunSelection] = None) -> bool:
+    """續期一個賬號的訂單；返回是否讀取到了訂單，登錄失敗等提前結束時返回 False"""
+    selection = selection or RunSelection()
+    log(f"[AutoEUServerless] 正在續費第 {i + 1} 個賬號")
+    progress.begin_account(i)
+    sessid, s, orders = "-1", None, {}
+    # 上次中斷的續期：恢復當時的會話，PIN 只在該會話內有效
+    checkpoints = {cp.order_id: cp for cp in load_checkpoints(username)}
+    if checkpoints:
+        latest = max(checkpoints.values(), key=lambda cp: cp.updated_at)
+        s = latest.restore_session(new_session(username))
+        orders = get_orders(latest.sess_id, s)
+        if orders:
+            sessid = latest.sess_id
+            log(f"[AutoEUServerless] 第 {i + 1} 個賬號恢復上次中斷的會話")
+        for cp in list(checkpoints.values()):
+            if not orders or cp.sess_id != latest.sess_id:
+                cp.discard()
+                del checkpoints[cp.order_id]
+    if sessid == "-1" and warm_sessions and username in warm_sessions:
+        # 復用上次登錄的會話，失效時再重新登錄
+        warm_id, warm_session = warm_sessions.pop(username)
+        orders = get_orders(warm_id, warm_session, quiet=True)
+        if orders:
+            sessid, s = warm_id, warm_session
+            log(f"[AutoEUServerless] 第 {i + 1} 個賬號復用已登錄的會話")
+    if sessid == "-1":
+        progress.phase("登錄中")
+        sessid, s = login(username, password)
+        if sessid == "-1":
+            log(f"[AutoEUServerless] 第 {i + 1} 個賬號登錄失敗，請檢查登錄資訊")
+            progress.phase("❗ 登錄失敗")
+            selection.history.record(username, "login_failed")
+            return False
+        progress.phase("讀取訂單")
+        orders = get_orders(sessid, s)
+    warm_sessions[username] = (sessid, s)
+    log(f"[AutoEUServerless] 檢測到第 {i + 1} 個賬號有 {len(orders)} 台 VPS，正在嘗試續期")
+    results = {}
+    for k, order in sorted(orders.items(), key=lambda item: order_urgency(item[1])):
+        if k not in checkpoints and not selection.select_order(username, order):
+            continue
+        if order.renewable or k in checkpoints:
+            checkpoint = checkpoints.get(k) or RenewalCheckpoint.new(username, k, sessid)
+            results[k] = renew(sessid, s, password, k, mailparser_dl_url_id, checkpoint=checkpoint)
+            if not results[k]:
+                log(f"[AutoEUServerless] ServerID: {k} 續訂錯誤!")
+            else:
+                log(f"[AutoEUServerless] ServerID: {k} 已成功續訂!")
+        elif order.extension_possible_from:
+            log(f"[AutoEUServerless] ServerID: {k} 無需更新，{order.extension_possible_from} 起可續期")
+        else:
+            log(f"[AutoEUServerless] ServerID: {k} 無需更新")
+    # 訂單頁面讀取失敗時 orders 為空，不能記為成功，否則 --only-failed-last-run 會跳過該賬號
+    status = "ok" if orders and all(results.values()) else "failed"
+    if not orders:
+        log(f"[AutoEUServerless] 第 {i + 1} 個賬號未讀取到訂單，記為失敗")
+    selection.history.record(username, status, orders=orders, results=results)
+    progress.phase("檢查續期狀態")
+    wait(15)
+    check(sessid, s)
+    wait(5)
+    progress.phase("✅ 完成")
+    return bool(orders)
+
+def load_accounts() -> List[Tuple[str, str, str]]:
+    """讀取並校驗賬號配置，返回 (用戶名, 密碼, mailparser 下載 ID) 列表；配置錯誤時退出"""
     if not USERNAME or not PASSWORD or not MAILPARSER_DOWNLOAD_URL_ID:
         log("[AutoEUServerless] 缺少必要的環境變量")
         exit(1)
@@ -462,34 +2673,235 @@ def main_handler(event, context):
     if len(user_list) != len(passwd_list):
         log("[AutoEUServerless] 用戶名和密碼數量不匹配!")
         exit(1)
+    if len(mailparser_dl_url_id_list) == 1 and len(user_list) > 1:
+        # 所有賬號共用一個收件箱，按收件人分配 PIN；收件人即登錄用的郵箱，用客戶編號登錄時無法分配
+        if not all("@" in username for username in user_list):
+            log("[AutoEUServerless] 共用 mailparser 收件箱時必須用郵箱登錄，用客戶編號登錄的賬號請各自配置收件箱")
+            exit(1)
+        shared_inboxes.add(mailparser_dl_url_id_list[0])
+        mailparser_dl_url_id_list = mailparser_dl_url_id_list * len(user_list)
     if len(mailparser_dl_url_id_list) != len(user_list):
         log("[AutoEUServerless] mailparser_dl_url_ids 和用戶名的數量不匹配!")
         exit(1)
-    for i in range(len(user_list)):
-        print("*" * 30)
-        log(f"[AutoEUServerless] 正在續費第 {i + 1} 個賬號")
-        sessid, s = login(user_list[i], passwd_list[i])
-        if sessid == "-1":
-            log(f"[AutoEUServerless] 第 {i + 1} 個賬號登錄失敗，請檢查登錄資訊")
-            continue
-        servers = get_servers(sessid, s)
-        log(f"[AutoEUServerless] 檢測到第 {i + 1} 個賬號有 {len(servers)} 台 VPS，正在嘗試續期")
-        for k, v in servers.items():
-            if v:
-                if not renew(sessid, s, passwd_list[i], k, mailparser_dl_url_id_list[i]):
-                    log(f"[AutoEUServerless] ServerID: {k} 續訂錯誤!")
-                else:
-                    log(f"[AutoEUServerless] ServerID: {k} 已成功續訂!")
-            else:
-                log(f"[AutoEUServerless] ServerID: {k} 無需更新")
-        time.sleep(15)
-        check(sessid, s)
-        time.sleep(5)
+    return list(zip(user_list, passwd_list, mailparser_dl_url_id_list))
+
+def run_accounts(accounts: Sequence[Tuple[str, str, str]], selection: RunSelection):
+    """在時間預算內依次處理選中的賬號，並記錄每個賬號的結果"""
+    selected = [i for i, (username, _, _) in enumerate(accounts) if selection.select_account(i, username)]
+    if not selection.everything:
+        log(f"[AutoEUServerless] 按選擇條件處理 {len(selected)}/{len(accounts)} 個賬號")
+    scheduler = RenewalScheduler(selection.history)
+    selected = scheduler.order(accounts, selected)
+    run_deadline = Deadline(max(RUN_TIME_BUDGET - REPORT_RESERVE_TIME, 1) if RUN_TIME_BUDGET > 0 else 0)
+    if PREFLIGHT and selected:
+        try:
+            selected = preflight(accounts, selected, selection.history, run_deadline)
+        except DeadlineExceeded:
+            log("[AutoEUServerless] 登錄預檢超出時間預算，跳過預檢")
+    progress.start(selected)
+    pending = list(selected)
+    try:
+        for i in selected:
+            print("*" * 30)
+            if run_deadline.expired():
+                raise DeadlineExceeded()
+            username = accounts[i][0]
+            if scheduler.can_defer(username, run_deadline):
+                # 記為 deferred，下次運行或 --only-failed-last-run 時處理
+                pending.remove(i)
+                selection.history.record(username, "deferred")
+                log(f"[AutoEUServerless] 剩餘時間預算不足，第 {i + 1} 個賬號的訂單可以等到下次運行，已推遲")
+                continue
+            account_deadline = Deadline(ACCOUNT_TIME_BUDGET, parent=run_deadline)
+            try:
+                with deadline_scope(account_deadline):
+                    if acquire_lease(i, username):
+                        try:
+                            started = clock.monotonic()
+                            # 登錄失敗等提前結束的耗時會拉低估算，使調度推遲實際需要完整時間的賬號
+                            if renew_account(i, *accounts[i], selection):
+                                selection.history.record_duration(username, clock.monotonic() - started)
+                        finally:
+                            release_lease(username)
+                pending.remove(i)
+            except DeadlineExceeded:
+                if run_deadline.expired():
+                    raise
+                pending.remove(i)
+                selection.history.record(accounts[i][0], "failed")
+                log(f"[AutoEUServerless] 第 {i + 1} 個賬號超出時間預算，已跳過剩餘步驟")
+    except DeadlineExceeded:
+        log("[AutoEUServerless] 運行時間預算耗盡，已取消剩餘工作並推送已有結果")
+    # 未完成的賬號記為失敗，下次可用 --only-failed-last-run 重試
+    for i in pending:
+        selection.history.record(accounts[i][0], "failed")
+    progress.finish("運行結束，詳細日誌見下一條消息")
+
+def main_handler(event, context, selection: Optional[RunSelection] = None):
+    accounts = load_accounts()
+    if STARTUP_PREWARM:
+        startup.start()
+    run_accounts(accounts, selection or RunSelection())
+    startup.shutdown()
 
     if TG_BOT_TOKEN and TG_USER_ID and TG_API_HOST:
         telegram()
 
     print("*" * 30)
 
+def telegram_text(text: str, limit: int = 3500) -> str:
+    """轉義為 parse_mode=HTML 可用的文本，並截取末尾不超過 limit 個字符（不會截斷實體）"""
+    parts, size = [], 0
+    for char in reversed(text):
+        escaped = html.escape(char, quote=False)
+        if size + len(escaped) > limit:
+            break
+        parts.append(escaped)
+        size += len(escaped)
+    return "".join(reversed(parts))
+
+class TelegramBot:
+    """長輪詢 Telegram 機器人：只執行 TG_USER_ID 發來的命令，在常駐進程中用預熱的模型和會話立即續期"""
+
+    HELP = (
+        "/status - 查看各賬號上次運行的結果\n"
+        "/renew &lt;用戶名|序號|訂單號&gt; - 立即續期指定賬號或訂單\n"
+        "/retry_failed - 重試上次失敗或未完成的賬號和訂單"
+    )
+
+    def __init__(self, accounts: Sequence[Tuple[str, str, str]]):
+        self.accounts = accounts
+        self.offset = 0
+        self.started_at = clock.time()
+        self.running = None
+        self._jobs = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bot-job")
+
+    def reply(self, text: str):
+        try:
+            send_telegram(text)
+        except Exception as e:
+            log(f"[Bot] Telegram 回覆失敗: {e}")
+
+    def poll(self) -> list:
+        response = BREAKERS["Telegram updates"].request(
+            "POST", f"{TG_API_HOST}/bot{TG_BOT_TOKEN}/getUpdates",
+            data={"offset": self.offset, "timeout": TG_BOT_POLL_TIMEOUT, "allowed_updates": '["message"]'},
+            timeout=TG_BOT_POLL_TIMEOUT + 10,
+        )
+        response.raise_for_status()
+        return response.json().get("result", [])
+
+    def status_text(self) -> str:
+        lines = ["<b>AutoEUServerless 狀態</b>", ""]
+        if self.running:
+            lines += [f"正在運行: {telegram_text(self.running)}", ""]
+        for i, (username, _, _) in enumerate(self.accounts):
+            record = run_history.get(username)
+            if record is None:
+                lines.append(f"賬號 {i + 1} {html.escape(username)}: 暫無記錄")
+                continue
+            updated = datetime.fromtimestamp(record["updated_at"]).strftime("%Y-%m-%d %H:%M")
+            lines.append(f"賬號 {i + 1} {html.escape(username)}: {record['status']} ({updated})")
+            for order_id, order in record.get("orders", {}).items():
+                due = order.get("extension_possible_from") or order.get("contract_end") or "-"
+                lines.append(f"  訂單 {order_id}: {order.get('status', '-')}，可續期日期 {due}")
+        return "\n".join(lines)
+
+    def selection_for(self, target: str) -> RunSelection:
+        usernames = [username for username, _, _ in self.accounts]
+        if target in usernames or (target.isdigit() and 1 <= int(target) <= len(usernames)):
+            return RunSelection(accounts=[target])
+        return RunSelection(orders=[target])
+
+    def submit(self, description: str, selection: RunSelection):
+        if self.running:
+            self.reply(telegram_text(f"正在運行 {self.running}，{description} 已排隊"))
+        else:
+            self.reply(telegram_text(f"開始 {description}"))
+        self._jobs.submit(self._run_job, description, selection)
+
+    def _run_job(self, description: str, selection: RunSelection):
+        global desp
+        self.running = description
+        desp = ""
+        try:
+            run_accounts(self.accounts, selection)
+        except Exception as e:
+            log(f"[Bot] {description} 出錯: {e}")
+        finally:
+            self.running = None
+        # Telegram 單條消息最多 4096 個字符，只保留日誌末尾
+        # desp 是原始日誌，可能包含響應中的 HTML 片段，轉義後再以 HTML 模式發送
+        self.reply(f"<b>{telegram_text(description)} 完成</b>\n\n" + telegram_text(desp))
+
+    def handle(self, update: dict):
+        self.offset = update["update_id"] + 1
+        message = update.get("message") or {}
+        sender = str((message.get("from") or {}).get("id", ""))
+        chat = str((message.get("chat") or {}).get("id", ""))
+        if sender != TG_USER_ID or chat != TG_USER_ID:
+            log(f"[Bot] 忽略未授權用戶 {sender} 的消息")
+            return
+        if message.get("date", 0) < self.started_at:
+            # 機器人未運行期間積壓的命令不再執行，以免重複續期
+            return
+        command, _, argument = message.get("text", "").strip().partition(" ")
+        command = command.split("@")[0].lower()
+        argument = argument.strip()
+        if command == "/status":
+            self.reply(self.status_text())
+        elif command == "/renew" and argument:
+            self.submit(f"續期 {argument}", self.selection_for(argument))
+        elif command == "/retry_failed":
+            self.submit("重試失敗項", RunSelection(only_failed=True))
+        else:
+            self.reply(self.HELP)
+
+    def run(self):
+        startup.start()
+        log("[Bot] 機器人已啟動")
+        self.reply("<b>AutoEUServerless 機器人已啟動</b>\n\n" + self.HELP)
+        while True:
+            try:
+                updates = self.poll()
+            except CircuitOpenError:
+                wait(CIRCUIT_COOLDOWN)
+                continue
+            except Exception as e:
+                log(f"[Bot] getUpdates 失敗: {e}")
+                wait(5)
+                continue
+            for update in updates:
+                self.handle(update)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="EUserv 自動續期")
+    parser.add_argument("--ocr-daemon", action="store_true", help="以 OCR 守護進程模式運行")
+    parser.add_argument("--bot", action="store_true",
+                        help="以 Telegram 機器人模式常駐運行，接受 /status、/renew 和 /retry_failed 命令")
+    parser.add_argument("--account", action="append",
+                        help="只處理該賬號（用戶名或從 1 開始的序號），可重複指定")
+    parser.add_argument("--order", action="append", help="只處理該訂單號，可重複指定")
+    parser.add_argument("--only-failed-last-run", action="store_true",
+                        help="只處理上次運行中失敗或未完成的賬號和訂單")
+    parser.add_argument("--due-within", metavar="DURATION",
+                        help="只處理在該時長內（如 12h、3d）可續期或到期的訂單")
+    args = parser.parse_args(argv)
+    if args.due_within:
+        try:
+            parse_duration(args.due_within)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
+
 if __name__ == "__main__":
-    main_handler(None, None)
+    args = parse_args()
+    if args.ocr_daemon:
+        run_ocr_daemon()
+    elif args.bot:
+        if not (TG_BOT_TOKEN and TG_USER_ID):
+            log("[Bot] 機器人模式需要 TG_BOT_TOKEN 和 TG_USER_ID")
+            sys.exit(1)
+        TelegramBot(load_accounts()).run()
+    else:
+        main_handler(None, None, RunSelection.from_args(args))
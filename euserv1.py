@@ -6,9 +6,11 @@ from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_t
 import requests.exceptions
 import ddddocr
 import json
+from http_trace import trace_session
 
 # Initialize a global session for consistent state management
-session = requests.Session()
+# Requests and responses are recorded to HTTP_TRACE_DIR when it is set
+session = trace_session(requests.Session())
 
 # Headers for HTTP requests
 HEADERS = {
@@ -120,11 +122,6 @@ def get_servers(sess_id: str) -> dict:
         response = session.get(url, headers=HEADERS, timeout=20)
         response.raise_for_status()
         
-        # Save HTML for debugging
-        with open("debug.html", "w", encoding="utf-8") as f:
-            f.write(response.text)
-        log("[AutoEUServerless] Saved HTML to debug.html for inspection")
-        
         soup = BeautifulSoup(response.text, "html.parser")
         # Update selector based on current HTML structure (inspect manually)
         table = soup.select_one("#kc2_order_customer_orders_tab_content_1")  # Placeholder
@@ -163,11 +160,6 @@ def renew(sess_id: str, password: str, order_id: str, mailparser_dl_url_id: str)
         }
         response = session.post(url, headers=HEADERS, data=data, timeout=20)
         response.raise_for_status()
-        
-        # Log response for debugging
-        with open("renew_response.html", "w", encoding="utf-8") as f:
-            f.write(response.text)
-        log(f"[AutoEUServerless] Renewal response saved to renew_response.html")
         log(f"[AutoEUServerless] Renewal response status: {response.status_code}")
         
         # Wait for server to process
@@ -0,0 +1,426 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+可選的 HTTP 追蹤記錄與回放
+
+* TraceRecorder 通過 requests 的 response hook 記錄請求/響應對，由後台線程寫入
+  gzip 壓縮的 JSON Lines 文件，每行一個類 HAR 的 entry；按大小和時間輪轉，按保留天數和文件數清理
+* 寫入前脫敏：Cookie、認證頭、密碼、PIN、token、API key、sess_id 以及 URL 中的 bot token 和下載 ID
+  替換為同一次運行內一致的假名，因此會話 ID 在記錄中仍能前後對應
+* replay_session() 用記錄的文件構造離線會話，按 方法 + 屏蔽秘密後的 URL 依次返回記錄的響應，可作為測試夾具
+
+用法:
+    HTTP_TRACE_DIR=.euserv_state/traces python euserv.py   # 記錄
+    python http_trace.py .euserv_state/traces/*.jsonl.gz   # 查看記錄
+"""
+
+import io
+import os
+import re
+import sys
+import gzip
+import hmac
+import json
+import time
+import queue
+import atexit
+import base64
+import hashlib
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+# 追蹤文件目錄，留空表示不記錄
+HTTP_TRACE_DIR = os.getenv('HTTP_TRACE_DIR', '')
+# 單個文件的最大大小（未壓縮字節）和最長寫入時間（秒），超過後輪轉到新文件
+HTTP_TRACE_MAX_BYTES = int(os.getenv('HTTP_TRACE_MAX_BYTES', str(5 * 1024 * 1024)))
+HTTP_TRACE_ROTATE_SECONDS = float(os.getenv('HTTP_TRACE_ROTATE_SECONDS', '3600'))
+# 追蹤文件保留的天數和個數
+HTTP_TRACE_MAX_AGE_DAYS = float(os.getenv('HTTP_TRACE_MAX_AGE_DAYS', '7'))
+HTTP_TRACE_MAX_FILES = int(os.getenv('HTTP_TRACE_MAX_FILES', '20'))
+# 每個請求或響應體最多記錄的字節數
+HTTP_TRACE_MAX_BODY = 1024 * 1024
+
+REDACTED = "[REDACTED]"
+SECRET_HEADERS = {"cookie", "set-cookie", "authorization", "proxy-authorization", "apikey", "x-api-key"}
+SECRET_FIELD_RE = re.compile(r"pass|pin|token|secret|auth|api_?key|sess_?id|phpsessid|userid", re.I)
+SECRET_URL_PATTERNS = (
+    re.compile(r"(/bot)([^/]+)"),  # Telegram bot token
+    re.compile(r"(files\.mailparser\.io/d/)([^/?]+)"),  # mailparser 下載 ID
+    re.compile(r"(/v1/download/)([^/?]+)"),
+)
+COOKIE_PAIR_RE = re.compile(r"([^=;,\s]+)=([^;,]*)")
+COOKIE_ATTRIBUTES = {"path", "domain", "expires", "max-age", "samesite", "secure", "httponly"}
+TEXT_MIME_RE = re.compile(r"text/|json|xml|javascript|x-www-form-urlencoded", re.I)
+# HTML 和其他文本中的秘密：鏈接和腳本裡的 name=value 參數，以及表單中的隱藏字段
+SECRET_NAME = r"[\w-]*(?:pass|pin|token|secret|auth|api_?key|sess_?id|phpsessid|userid)[\w-]*"
+TEXT_PARAM_RE = re.compile(r"(\b" + SECRET_NAME + r"=)([^&\"'\s<>;]+)", re.I)
+TEXT_INPUT_RE = re.compile(
+    r"(<input\b[^>]*\bname=[\"']?" + SECRET_NAME + r"[\"']?[^>]*\bvalue=[\"']?)([^\"'\s>]*)", re.I
+)
+# 日誌文本（如推送到 Telegram 的運行日誌）中的 "PIN: 123456"
+TEXT_LABEL_RE = re.compile(r"(\b(?:PIN|[Tt]oken)\s*[:：]\s*)([0-9A-Za-z_-]{4,})")
+
+# 每個進程隨機的 HMAC 密鑰：同一秘密在一次運行的記錄中替換為相同的假名，
+# 會話 ID 等值在記錄中保持前後一致，但無法從假名反推原值
+_PSEUDONYM_KEY = os.urandom(16)
+
+def pseudonym(value: str) -> str:
+    return "redacted" + hmac.new(_PSEUDONYM_KEY, value.encode("utf-8"), hashlib.sha256).hexdigest()[:24]
+
+def mask(value: str) -> str:
+    return REDACTED
+
+def redact_url(url: str, replace=pseudonym) -> str:
+    for pattern in SECRET_URL_PATTERNS:
+        url = pattern.sub(lambda m: m.group(1) + replace(m.group(2)), url)
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    return urlunsplit(parts._replace(query=redact_form(parts.query, replace)))
+
+def redact_form(text: str, replace=pseudonym) -> str:
+    # 其他字段的值可能是日誌等自由文本，按文本規則脫敏
+    return urlencode(
+        [(k, replace(v) if SECRET_FIELD_RE.search(k) else redact_text(v, replace))
+         for k, v in parse_qsl(text, keep_blank_values=True)],
+        safe="[]",
+    )
+
+def _redact_cookies(value: str) -> str:
+    return COOKIE_PAIR_RE.sub(
+        lambda m: m.group(0) if m.group(1).lower() in COOKIE_ATTRIBUTES else f"{m.group(1)}={pseudonym(m.group(2))}",
+        value,
+    )
+
+def redact_headers(headers) -> List[Dict[str, str]]:
+    redacted = []
+    for name, value in headers.items():
+        if name.lower() in ("cookie", "set-cookie"):
+            value = _redact_cookies(str(value))
+        elif name.lower() in SECRET_HEADERS:
+            value = pseudonym(str(value))
+        redacted.append({"name": name, "value": str(value)})
+    return redacted
+
+def _redact_json(value):
+    if isinstance(value, dict):
+        # 秘密字段整個替換，包括 {"token": {"value": ...}} 這樣的嵌套值
+        return {
+            k: pseudonym(v if isinstance(v, str) else json.dumps(v, sort_keys=True))
+            if SECRET_FIELD_RE.search(str(k)) else _redact_json(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [_redact_json(v) for v in value]
+    return value
+
+def redact_text(text: str, replace=pseudonym) -> str:
+    """HTML、腳本等文本中按參數名和表單字段名脫敏，例如控制面板鏈接中的 sess_id"""
+    text = TEXT_INPUT_RE.sub(lambda m: m.group(1) + replace(m.group(2)), text)
+    text = TEXT_LABEL_RE.sub(lambda m: m.group(1) + replace(m.group(2)), text)
+    return TEXT_PARAM_RE.sub(lambda m: m.group(1) + replace(m.group(2)), text)
+
+def redact_multipart(body: bytes, mime_type: str) -> bytes:
+    """multipart 表單中名稱為秘密字段的部分替換為假名，其餘部分（如上傳的圖片）保持不變"""
+    match = re.search(r'boundary="?([^";]+)"?', mime_type)
+    if not match:
+        return body
+    delimiter = b"--" + match.group(1).encode("latin-1")
+    parts = body.split(delimiter)
+    for index, part in enumerate(parts):
+        head, sep, payload = part.partition(b"\r\n\r\n")
+        name = re.search(rb'name="([^"]*)"', head)
+        if not sep or not name or not SECRET_FIELD_RE.search(name.group(1).decode("latin-1")):
+            continue
+        value, _, tail = payload.rpartition(b"\r\n")
+        parts[index] = head + sep + pseudonym(value.decode("utf-8", errors="replace")).encode("ascii") + b"\r\n" + tail
+    return delimiter.join(parts)
+
+def redact_body(body: bytes, mime_type: str) -> Dict[str, str]:
+    """返回 HAR 的 content/postData 結構；表單、JSON、multipart 按字段名脫敏，HTML 等文本按參數名脫敏，
+    二進制內容用 base64"""
+    truncated = len(body) > HTTP_TRACE_MAX_BODY
+    body = body[:HTTP_TRACE_MAX_BODY]
+    content = {"mimeType": mime_type, "size": len(body)}
+    if truncated:
+        content["truncated"] = True
+    if "multipart/" in mime_type:
+        body = redact_multipart(body, mime_type)
+    if mime_type and not TEXT_MIME_RE.search(mime_type):
+        content["encoding"] = "base64"
+        content["text"] = base64.b64encode(body).decode("ascii")
+        return content
+    text = body.decode("utf-8", errors="replace")
+    if "x-www-form-urlencoded" in mime_type:
+        text = redact_form(text)
+    elif "json" in mime_type:
+        try:
+            text = json.dumps(_redact_json(json.loads(text)), ensure_ascii=False)
+        except ValueError:
+            text = redact_text(text)
+    else:
+        text = redact_text(text)
+    content["text"] = text
+    return content
+
+def decode_content(content: Dict[str, str]) -> bytes:
+    if content.get("encoding") == "base64":
+        return base64.b64decode(content.get("text", ""))
+    return content.get("text", "").encode("utf-8")
+
+class _TeeRaw:
+    """包裝流式響應的 raw，調用方讀取的數據同時收集起來，響應關閉或讀完時交給 on_done。
+    調用方提前停止讀取時只記錄已讀取的部分，回放時同樣的代碼讀到同樣的位置"""
+
+    def __init__(self, raw, on_done):
+        self._raw = raw
+        self._on_done = on_done
+        self._chunks = []
+        self._finished = False
+
+    def _collect(self, chunk: bytes) -> bytes:
+        if chunk:
+            self._chunks.append(chunk)
+        return chunk
+
+    def _finish(self, complete: bool):
+        if not self._finished:
+            self._finished = True
+            self._on_done(b"".join(self._chunks), complete)
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        if hasattr(self._raw, "stream"):
+            chunks = self._raw.stream(amt, decode_content=decode_content)
+        else:
+            chunks = iter(lambda: self._raw.read(amt), b"")
+        for chunk in chunks:
+            yield self._collect(chunk)
+        self._finish(True)
+
+    def read(self, *args, **kwargs):
+        chunk = self._collect(self._raw.read(*args, **kwargs))
+        if not chunk:
+            self._finish(True)
+        return chunk
+
+    def close(self):
+        self._finish(False)
+        return self._raw.close()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+class TraceRecorder:
+    """把經過的請求/響應對交給後台線程，脫敏後寫入輪轉的 gzip 追蹤文件"""
+
+    def __init__(self, directory: str, max_bytes: int = HTTP_TRACE_MAX_BYTES,
+                 rotate_seconds: float = HTTP_TRACE_ROTATE_SECONDS,
+                 max_age_days: float = HTTP_TRACE_MAX_AGE_DAYS, max_files: int = HTTP_TRACE_MAX_FILES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.max_age_days = max_age_days
+        self.max_files = max_files
+        self._queue = queue.Queue()
+        self._file = None
+        self._opened_at = 0.0
+        self._written = 0
+        self._sequence = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def attach(self, session: requests.Session) -> requests.Session:
+        """在會話上註冊 response hook，返回同一個會話"""
+        session.hooks["response"].append(self._on_response)
+        return session
+
+    def _on_response(self, response: requests.Response, *args, **kwargs):
+        request = response.request
+        body = request.body or b""
+        started = time.time()
+        self._ensure_started()
+
+        def record(content: bytes, complete: bool = True):
+            self._queue.put((
+                started,
+                request.method,
+                request.url,
+                dict(request.headers),
+                body.encode("utf-8") if isinstance(body, str) else body if isinstance(body, bytes) else b"",
+                response.status_code,
+                response.reason,
+                dict(response.headers),
+                content,
+                complete,
+                response.elapsed.total_seconds(),
+            ))
+
+        if kwargs.get("stream", False) and response.raw is not None:
+            # 流式響應不能在這裡讀取，否則會破壞提前關閉連接的優化；記錄調用方實際讀取的數據
+            response.raw = _TeeRaw(response.raw, record)
+        else:
+            record(response.content)
+        return response
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="http-trace", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _entry(self, item) -> dict:
+        started, method, url, req_headers, req_body, status, reason, resp_headers, resp_body, complete, elapsed = item
+        req_type = CaseInsensitiveDict(req_headers).get("Content-Type", "")
+        resp_type = CaseInsensitiveDict(resp_headers).get("Content-Type", "")
+        request = {"method": method, "url": redact_url(url), "headers": redact_headers(req_headers)}
+        if req_body:
+            request["postData"] = redact_body(req_body, req_type)
+        response = {"status": status, "statusText": reason, "headers": redact_headers(resp_headers)}
+        response["content"] = redact_body(resp_body, resp_type)
+        if not complete:
+            response["content"]["partial"] = True
+        return {
+            "startedDateTime": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+            "time": round(elapsed * 1000, 1),
+            "request": request,
+            "response": response,
+        }
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence += 1
+        name = time.strftime("trace-%Y%m%d-%H%M%S", time.gmtime()) + f"-{os.getpid()}-{self._sequence:04d}.jsonl.gz"
+        self._file = gzip.open(os.path.join(self.directory, name), "wt", encoding="utf-8")
+        os.chmod(os.path.join(self.directory, name), 0o600)
+        self._opened_at = time.monotonic()
+        self._written = 0
+        self._prune()
+
+    def _prune(self):
+        files = sorted(
+            (os.path.join(self.directory, name) for name in os.listdir(self.directory)
+             if name.startswith("trace-") and name.endswith(".jsonl.gz")),
+            key=os.path.getmtime,
+        )
+        cutoff = time.time() - self.max_age_days * 86400
+        for index, path in enumerate(files):
+            if index < len(files) - self.max_files or os.path.getmtime(path) < cutoff:
+                if path != getattr(self._file, "name", None):
+                    os.remove(path)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                if (self._file is None or self._written >= self.max_bytes
+                        or time.monotonic() - self._opened_at >= self.rotate_seconds):
+                    self._rotate()
+                line = json.dumps(self._entry(item), ensure_ascii=False) + "\n"
+                self._file.write(line)
+                self._written += len(line)
+                if self._queue.empty():
+                    self._file.flush()
+            except Exception as e:
+                # 寫入失敗不中斷記錄線程；提示寫到標準錯誤，不混入標準輸出中的運行日誌
+                print(f"HTTP 追蹤記錄寫入失敗: {e}", file=sys.stderr)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        """寫完隊列中剩餘的記錄並關閉文件"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout=10)
+
+_recorder = None
+
+def recorder_from_env() -> Optional[TraceRecorder]:
+    """HTTP_TRACE_DIR 已設置時返回進程內共用的記錄器"""
+    global _recorder
+    if HTTP_TRACE_DIR and _recorder is None:
+        _recorder = TraceRecorder(HTTP_TRACE_DIR)
+    return _recorder
+
+def trace_session(session: requests.Session) -> requests.Session:
+    recorder = recorder_from_env()
+    return recorder.attach(session) if recorder else session
+
+def load_entries(paths: Sequence[str]) -> Iterator[dict]:
+    """按順序讀取追蹤文件中的 entry；進程中斷留下的不完整文件讀到可用部分為止"""
+    for path in paths:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    yield json.loads(line)
+        except (EOFError, ValueError):
+            continue
+
+class ReplayAdapter(BaseAdapter):
+    """按 方法 + 屏蔽秘密後的 URL 依次返回記錄的響應；同一請求的記錄用完後重複最後一條"""
+
+    def __init__(self, entries: Sequence[dict]):
+        super().__init__()
+        self._responses = {}
+        for entry in entries:
+            key = (entry["request"]["method"], redact_url(entry["request"]["url"], mask))
+            self._responses.setdefault(key, []).append(entry["response"])
+        self._cursor = {}
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        key = (request.method, redact_url(request.url, mask))
+        recorded = self._responses.get(key)
+        if not recorded:
+            raise requests.ConnectionError(f"沒有記錄的響應: {key[0]} {key[1]}", request=request)
+        index = self._cursor.get(key, 0)
+        self._cursor[key] = index + 1
+        entry = recorded[min(index, len(recorded) - 1)]
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry.get("statusText", "")
+        response.headers = CaseInsensitiveDict(
+            # 記錄的是解壓後的內容，回放時去掉編碼和長度頭
+            (h["name"], h["value"]) for h in entry["headers"]
+            if h["name"].lower() not in ("content-encoding", "content-length", "transfer-encoding")
+        )
+        # 通過 raw 返回內容，流式和非流式讀取都可以回放
+        response.raw = io.BytesIO(decode_content(entry["content"]))
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+def replay_session(paths: Sequence[str]) -> requests.Session:
+    """返回只從追蹤文件回放響應的會話，用於離線測試"""
+    session = requests.Session()
+    adapter = ReplayAdapter(list(load_entries(paths)))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def summarize(paths: Sequence[str]) -> List[Tuple[str, str, int, int]]:
+    return [
+        (e["startedDateTime"], f'{e["request"]["method"]} {e["request"]["url"]}',
+         e["response"]["status"], e["response"]["content"].get("size", 0))
+        for e in load_entries(paths)
+    ]
+
+if __name__ == "__main__":
+    for started, request_line, status, size in summarize(sys.argv[1:]):
+        print(f"{started}  {status}  {size:>8}  {request_line}")
@@ -27,6 +27,7 @@ import re
 import json
 import time
 import base64
+from operator import add, mul, sub
 
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
@@ -145,6 +146,10 @@ def captcha_solver(captcha_image_url: str, session: requests.session) -> dict:
     return j
 
 
+# only these operators are evaluated, never the raw OCR text
+ARITHMETIC_OPERATORS = {"+": add, "-": sub, "*": mul}
+
+
 def handle_captcha_solved_result(solved: dict) -> str:
     """Since CAPTCHA sometimes appears as a very simple binary arithmetic expression.
     But since recognition sometimes doesn't show the result of the calculation directly,
@@ -171,11 +176,7 @@ def handle_captcha_solved_result(solved: dict) -> str:
                     left_part = text[:operator_pos]
                     right_part = text[operator_pos + 1 :]
                     if left_part.isdigit() and right_part.isdigit():
-                        return eval(
-                            "{left} {operator} {right}".format(
-                                left=left_part, operator=operator, right=right_part
-                            )
-                        )
+                        return ARITHMETIC_OPERATORS[operator](int(left_part), int(right_part))
                     else:
                         # Because these symbols("X", "x", "+", "-") do not appear at the same time,
                         # it just contains an arithmetic symbol.
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# 測試使用臨時狀態目錄，不讀寫 .euserv_state；需要在導入 euserv 之前設置
+os.environ.setdefault("STATE_DIR", tempfile.mkdtemp(prefix="euserv-test-"))
+os.environ.setdefault("STARTUP_PREWARM", "0")
+os.environ.setdefault("HTTP_TRACE_DIR", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,35 @@
+import euserv
+
+
+def test_telegram_text_escapes_and_keeps_whole_entities():
+    text = "log line\n" + "<b>" * 2000 + "tail & <end>"
+    escaped = euserv.telegram_text(text, limit=100)
+    assert len(escaped) <= 100
+    assert escaped.endswith("tail &amp; &lt;end&gt;")
+    assert "<" not in escaped
+
+
+def test_bot_commands(monkeypatch):
+    sent, jobs = [], []
+    monkeypatch.setattr(euserv, "TG_USER_ID", "42")
+    monkeypatch.setattr(euserv, "send_telegram", sent.append)
+    bot = euserv.TelegramBot([("a@example.com", "pw", "inbox"), ("b@example.com", "pw", "inbox")])
+    monkeypatch.setattr(bot, "submit", lambda description, selection: jobs.append((description, selection)))
+    now = int(euserv.clock.time()) + 1
+
+    def message(update_id, text, sender=42):
+        bot.handle({"update_id": update_id, "message": {
+            "from": {"id": sender}, "chat": {"id": sender}, "date": now, "text": text,
+        }})
+
+    message(1, "/renew 2", sender=7)
+    assert sent == [] and jobs == []
+    message(2, "/renew@my_bot 2")
+    message(3, "/renew 470001")
+    message(4, "/retry_failed")
+    message(5, "/status")
+    assert bot.offset == 6
+    assert jobs[0][1].accounts == {"2"}
+    assert jobs[1][1].orders == {"470001"}
+    assert jobs[2][1].only_failed
+    assert "a@example.com" in sent[-1]
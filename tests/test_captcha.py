@@ -0,0 +1,172 @@
+import pytest
+
+import euserv
+
+
+class ImageSession:
+    def get(self, url, timeout=None):
+        response = euserv.requests.Response()
+        response.status_code = 200
+        response._content = b"\x89PNG\r\n\x1a\nnot really a png"
+        return response
+
+
+@pytest.fixture
+def sim_clock():
+    previous = euserv.set_clock(euserv.SimulatedClock())
+    yield
+    euserv.set_clock(previous)
+
+
+def test_open_breaker_is_skipped_without_recording_a_failure(sim_clock, monkeypatch):
+    recorded = []
+    monkeypatch.setenv("OCR_SPACE_API_KEY", "key")
+    monkeypatch.setattr(euserv, "OCR_SPACE_API_KEY", "key")
+    monkeypatch.setattr(euserv, "CAPTCHA_ENGINES", ("OCR.space",))
+    monkeypatch.setattr(euserv.engine_selector, "record", lambda *args: recorded.append(args))
+    breaker = euserv.CircuitBreaker("OCR.space")
+    breaker.state = breaker.OPEN
+    breaker._opened_at = euserv.clock.monotonic()
+    monkeypatch.setitem(euserv.BREAKERS, "OCR.space", breaker)
+
+    solved = euserv.captcha_solver("https://support.euserv.com/securimage_show.php", ImageSession())
+
+    assert "error" in solved
+    assert recorded == []
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("3 + 4", 7),
+    ("12x3", 36),
+    ("8 - 2", 6),
+    ("5*6", 30),
+])
+def test_safe_eval_arithmetic(text, expected):
+    assert euserv.safe_eval_arithmetic(text) == expected
+
+
+@pytest.mark.parametrize("text", ["__import__('os')", "2 ** 100", "abc", "1 / 0"])
+def test_safe_eval_arithmetic_rejects_other_expressions(text):
+    assert euserv.safe_eval_arithmetic(text) is None
+
+
+def test_inline_answer_is_submitted_again_at_the_captcha_prompt(monkeypatch):
+    """inline 模式下即使只有一個候選，出現驗證碼提示後也要在驗證碼步驟提交它"""
+    captcha_posts = []
+
+    class LoginSession(euserv.requests.Session):
+        def request(self, method, url, data=None, **kwargs):
+            response = euserv.requests.Response()
+            response.status_code = 200
+            response.encoding = "utf-8"
+            if method == "GET":
+                response.headers["Set-Cookie"] = "PHPSESSID=abcdefghijkl; path=/"
+                response._content = b""
+            elif "email" in data:
+                response._content = b"To finish the login process please solve the following captcha."
+            else:
+                captcha_posts.append(data["captcha_code"])
+                response._content = b"Hello"
+            return response
+
+    monkeypatch.setattr(euserv, "CAPTCHA_SPECULATIVE", "inline")
+    monkeypatch.setattr(euserv, "new_session", lambda username: LoginSession())
+    monkeypatch.setattr(euserv, "captcha_solver", lambda url, session, record=True: {
+        "result": "abcdef", "candidates": [("abcdef", None)], "engine": "OCR.space", "latency": 0.1,
+    })
+    monkeypatch.setattr(euserv.engine_selector, "record", lambda *args: None)
+
+    sess_id, _ = euserv.login("user@example.com", "pw")
+
+    assert sess_id == "abcdefghijkl"
+    assert captcha_posts == ["abcdef"]
+
+
+def test_startup_prewarms_only_the_first_engine(monkeypatch):
+    monkeypatch.setattr(euserv, "OCR_SPACE_API_KEY", "key")
+    monkeypatch.setattr(euserv, "TG_BOT_TOKEN", "")
+    monkeypatch.setattr(euserv, "egress_pool", None)
+    monkeypatch.setattr(euserv, "CAPTCHA_ENGINE_SELECTION", "fixed")
+    monkeypatch.setattr(euserv, "CAPTCHA_SPECULATIVE", "prefetch")
+    pipeline = euserv.StartupPipeline()
+    submitted = []
+    monkeypatch.setattr(pipeline, "submit", lambda name, *args: submitted.append(name))
+    pipeline.start()
+    assert submitted == ["Mailparser", "OCR.space"]
+
+
+def test_startup_skips_captcha_engines_when_no_captcha_is_expected(monkeypatch):
+    monkeypatch.setattr(euserv, "TG_BOT_TOKEN", "")
+    monkeypatch.setattr(euserv, "egress_pool", None)
+    monkeypatch.setattr(euserv, "CAPTCHA_SPECULATIVE", "off")
+    monkeypatch.setattr(euserv, "engine_selector", euserv.EngineSelector(None))
+    pipeline = euserv.StartupPipeline()
+    submitted = []
+    monkeypatch.setattr(pipeline, "submit", lambda name, *args: submitted.append(name))
+    pipeline.start()
+    assert submitted == ["Mailparser"]
+
+
+def test_harvest_captcha_sorts_samples_by_outcome(tmp_path, monkeypatch):
+    monkeypatch.setattr(euserv, "CAPTCHA_HARVEST_DIR", str(tmp_path))
+    euserv.harvest_captcha(b"\x89PNG passed", "ab12", ["ab12"])
+    euserv.harvest_captcha(b"\x89PNG failed", None, ["x", "y"])
+    assert [p.name.split("_")[0] for p in (tmp_path / "passed").iterdir()] == ["ab12"]
+    assert sorted(p.suffix for p in (tmp_path / "failed").iterdir()) == [".json", ".png"]
+
+
+def test_speculative_solve_defers_engine_failures(sim_clock, monkeypatch):
+    recorded = []
+
+    class DownSession(euserv.requests.Session):
+        def request(self, *args, **kwargs):
+            raise euserv.requests.ConnectionError("down")
+
+    monkeypatch.setattr(euserv, "OCR_SPACE_API_KEY", "key")
+    monkeypatch.setenv("OCR_SPACE_API_KEY", "key")
+    monkeypatch.setattr(euserv, "CAPTCHA_ENGINES", ("OCR.space",))
+    monkeypatch.setattr(euserv.engine_selector, "record", lambda *args: recorded.append(args))
+    breaker = euserv.CircuitBreaker("OCR.space")
+    breaker._session = DownSession()
+    monkeypatch.setitem(euserv.BREAKERS, "OCR.space", breaker)
+
+    solved = euserv.captcha_solver("https://support.euserv.com/securimage_show.php", ImageSession(), record=False)
+
+    assert recorded == []
+    assert solved["failed_engines"] and solved["failed_engines"][0][0] == "OCR.space"
+    euserv.record_speculative_failures(solved)
+    assert len(recorded) == len(solved["failed_engines"])
+
+
+def test_prefetch_is_not_recorded_when_no_captcha_is_needed(monkeypatch):
+    recorded, solver_sessions = [], []
+
+    class LoginSession(euserv.requests.Session):
+        def request(self, method, url, data=None, **kwargs):
+            response = euserv.requests.Response()
+            response.status_code = 200
+            response.encoding = "utf-8"
+            response._content = b"Hello"
+            if method == "GET":
+                response.headers["Set-Cookie"] = "PHPSESSID=abcdefghijkl; path=/"
+                response._content = b""
+            return response
+
+    def solver(url, session, record=True):
+        solver_sessions.append((session, record))
+        return {"result": "abcdef", "candidates": [("abcdef", None)], "engine": "OCR.space",
+                "latency": 0.1, "failed_engines": [("ddddocr", 0.2)]}
+
+    account_session = LoginSession()
+    sessions = iter([account_session, LoginSession()])
+    monkeypatch.setattr(euserv, "CAPTCHA_SPECULATIVE", "prefetch")
+    monkeypatch.setattr(euserv, "new_session", lambda username: next(sessions))
+    monkeypatch.setattr(euserv, "captcha_solver", solver)
+    monkeypatch.setattr(euserv.engine_selector, "record", lambda *args: recorded.append(args))
+
+    sess_id, session = euserv.login("user@example.com", "pw")
+
+    assert sess_id == "abcdefghijkl" and session is account_session
+    assert recorded == []
+    euserv._captcha_prefetch.submit(lambda: None).result()
+    assert all(s is not account_session and not record for s, record in solver_sessions)
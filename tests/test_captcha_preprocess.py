@@ -0,0 +1,82 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+import euserv
+
+
+def captcha_png(background=255, ink=0):
+    image = Image.new("L", (200, 60), background)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((60, 20, 110, 40), fill=ink)
+    # securimage 風格的單像素干擾線
+    draw.line((0, 5, 199, 55), fill=ink, width=1)
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
+
+
+@pytest.fixture
+def preprocess_on(monkeypatch):
+    monkeypatch.setattr(euserv, "CAPTCHA_PREPROCESS", True)
+
+
+def test_preprocess_is_off_by_default():
+    data = captcha_png()
+    assert euserv.preprocess_captcha(data) == data
+
+
+def test_threshold_separates_ink_from_background():
+    gray = euserv.np.array([[10] * 50 + [240] * 50], dtype=euserv.np.uint8)
+    assert 10 <= euserv._otsu_threshold(gray) < 240
+
+
+@pytest.mark.parametrize("background, ink", [(255, 0), (0, 255)])
+def test_preprocess_removes_noise_and_crops_to_the_glyphs(preprocess_on, background, ink):
+    cleaned = Image.open(io.BytesIO(euserv.preprocess_captcha(captcha_png(background, ink))))
+    padding = euserv.CAPTCHA_CROP_PADDING
+    assert cleaned.format == "PNG" and cleaned.mode == "1"
+    assert cleaned.size == (51 + 2 * padding, 21 + 2 * padding)
+    # 白底黑字：四角是背景
+    assert cleaned.getpixel((0, 0)) == 255
+    assert cleaned.getpixel((cleaned.width // 2, cleaned.height // 2)) == 0
+
+
+def test_preprocess_falls_back_to_the_original_on_bad_input(preprocess_on):
+    assert euserv.preprocess_captcha(b"not an image") == b"not an image"
+    blank = io.BytesIO()
+    Image.new("L", (20, 20), 255).save(blank, format="PNG")
+    assert euserv.preprocess_captcha(blank.getvalue()) == blank.getvalue()
+
+
+def test_ocr_space_gets_the_cleaned_image_as_multipart(preprocess_on, monkeypatch):
+    original = captcha_png()
+    uploads = []
+
+    class CaptchaSession(euserv.requests.Session):
+        def request(self, method, url, data=None, files=None, **kwargs):
+            response = euserv.requests.Response()
+            response.status_code = 200
+            if method == "GET":
+                response._content = original
+            else:
+                uploads.append((data, files))
+                response._content = b'{"ParsedResults": [{"ParsedText": "ab12"}]}'
+            return response
+
+    monkeypatch.setenv("OCR_SPACE_API_KEY", "key")
+    monkeypatch.setattr(euserv, "OCR_SPACE_API_KEY", "key")
+    monkeypatch.setattr(euserv, "CAPTCHA_ENGINES", ("OCR.space",))
+    monkeypatch.setitem(euserv.BREAKERS, "OCR.space", euserv.CircuitBreaker("OCR.space"))
+
+    solved = euserv.captcha_solver("https://support.euserv.com/securimage_show.php", CaptchaSession())
+
+    assert solved["result"] == "ab12"
+    (data, files), = uploads
+    name, image, content_type = files["file"]
+    assert image == euserv.preprocess_captcha(original) and image != original
+    assert content_type == "application/octet-stream"
+    assert data["filetype"] == "PNG" and "base64Image" not in data
+    # 預處理只影響提交給識別引擎的圖片，樣本收集仍保存原圖
+    assert solved["image"] == original
@@ -0,0 +1,44 @@
+import json
+
+import requests
+
+import euserv
+
+
+def test_checkpoint_never_writes_the_pin(tmp_path):
+    cp = euserv.RenewalCheckpoint(str(tmp_path / "cp.json"), "100", "sess")
+    cp.pin = "123456"
+    cp.advance("pin_received", requests.Session())
+    with open(cp.path, encoding="utf-8") as f:
+        data = json.load(f)
+    assert "pin" not in data
+    assert "123456" not in json.dumps(data)
+    assert euserv.RenewalCheckpoint.load(cp.path).pin == ""
+
+
+def test_resume_after_pin_received_requests_a_new_pin(monkeypatch):
+    ran = []
+
+    def step(name):
+        def run(cp, session, mailparser_dl_url_id):
+            ran.append(name)
+            return True
+        return run
+
+    monkeypatch.setattr(euserv, "RENEW_STEPS", tuple(
+        (state, step(state)) for state, _ in euserv.RENEW_STEPS
+    ))
+    cp = euserv.RenewalCheckpoint(None, "100", "sess", state="pin_received")
+    assert euserv.renew("sess", requests.Session(), "", "100", "", checkpoint=cp)
+    assert ran == ["pin_requested", "pin_received", "token", "submitted", "verified"]
+
+
+def test_unwritable_state_dir_keeps_the_renewal_in_memory(tmp_path, monkeypatch):
+    (tmp_path / "file").write_text("")
+    monkeypatch.setattr(euserv, "RENEW_STEPS", tuple(
+        (state, lambda cp, session, mailparser_dl_url_id: True) for state, _ in euserv.RENEW_STEPS
+    ))
+    cp = euserv.RenewalCheckpoint(str(tmp_path / "file" / "cp.json"), "100", "sess")
+    assert euserv.renew("sess", requests.Session(), "", "100", "", checkpoint=cp)
+    assert cp.path is None
+    assert "斷點保存失敗" in euserv.desp
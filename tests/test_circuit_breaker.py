@@ -0,0 +1,52 @@
+import pytest
+import requests
+
+import euserv
+
+
+class FakeSession:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+
+    def request(self, method, url, **kwargs):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        return response
+
+
+@pytest.fixture
+def sim_clock():
+    previous = euserv.set_clock(euserv.SimulatedClock())
+    yield euserv.clock
+    euserv.set_clock(previous)
+
+
+def test_one_failure_after_one_success_does_not_trip(sim_clock):
+    breaker = euserv.CircuitBreaker("test")
+    breaker.request("GET", "https://example.com/", session=FakeSession(200))
+    with pytest.raises(requests.ConnectionError):
+        breaker.request("GET", "https://example.com/", session=FakeSession(requests.ConnectionError()))
+    assert breaker.state == breaker.CLOSED
+
+
+def test_repeated_failures_trip_the_breaker(sim_clock):
+    breaker = euserv.CircuitBreaker("test")
+    for _ in range(euserv.CIRCUIT_MIN_CALLS):
+        breaker.request("GET", "https://example.com/", session=FakeSession(503))
+    assert breaker.state == breaker.OPEN
+    with pytest.raises(euserv.CircuitOpenError):
+        breaker.request("GET", "https://example.com/", session=FakeSession(200))
+
+
+def test_probe_is_released_after_an_unexpected_exception(sim_clock):
+    breaker = euserv.CircuitBreaker("test", min_calls=1, cooldown=10)
+    breaker.request("GET", "https://example.com/", session=FakeSession(500))
+    sim_clock.sleep(10)
+    with pytest.raises(euserv.DeadlineExceeded):
+        breaker.request("GET", "https://example.com/", session=FakeSession(euserv.DeadlineExceeded()))
+    # 探測名額已交還，下一次請求可以探測並恢復服務
+    breaker.request("GET", "https://example.com/", session=FakeSession(200))
+    assert breaker.state == breaker.CLOSED
@@ -0,0 +1,52 @@
+import euserv
+
+SPECS = ["http://proxy-a:8080", "http://proxy-b:8080", "src:192.0.2.10"]
+
+
+def checked_pool(specs=SPECS):
+    pool = euserv.EgressPool(specs)
+    pool._checked = True
+    return pool
+
+
+def test_malformed_specs_are_skipped():
+    pool = euserv.EgressPool(["ftp://nowhere", "http://proxy-a:8080", "not-an-ip", "http://h:99999"])
+    assert [e.spec for e in pool.egresses] == ["http://proxy-a:8080"]
+    assert "已忽略無效的出口 ftp://nowhere" in euserv.desp
+    assert euserv.create_egress_pool(["not-an-ip"]) is None
+    assert euserv.create_egress_pool([]) is None
+
+
+def test_assignment_is_sticky_across_runs():
+    accounts = [f"user{i}@example.com" for i in range(20)]
+    first = {a: checked_pool().assign(a).spec for a in accounts}
+    second_pool = checked_pool(list(reversed(SPECS)))
+    assert {a: second_pool.assign(a).spec for a in accounts} == first
+    # 多個賬號會分散到不同的出口
+    assert len(set(first.values())) > 1
+
+
+def test_failed_egress_moves_only_its_accounts():
+    pool = checked_pool()
+    accounts = [f"user{i}@example.com" for i in range(20)]
+    before = {a: pool.assign(a) for a in accounts}
+    failed = before[accounts[0]]
+    for _ in range(euserv.EGRESS_MAX_FAILURES):
+        pool.record_failure(failed)
+    assert not failed.healthy
+    after = {a: pool.assign(a) for a in accounts}
+    for account in accounts:
+        if before[account] is failed:
+            assert after[account] is not failed and after[account].healthy
+        else:
+            assert after[account] is before[account]
+
+
+def test_success_resets_the_failure_count():
+    pool = checked_pool()
+    egress = pool.egresses[0]
+    for _ in range(euserv.EGRESS_MAX_FAILURES - 1):
+        pool.record_failure(egress)
+    pool.record_success(egress)
+    pool.record_failure(egress)
+    assert egress.healthy
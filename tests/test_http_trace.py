@@ -0,0 +1,121 @@
+import io
+import json
+import gzip
+
+import requests
+from requests.adapters import BaseAdapter
+
+import http_trace
+from http_trace import redact_body, redact_form, redact_text, redact_url, replay_session, TraceRecorder
+
+
+def test_secret_json_value_is_masked_whole():
+    content = redact_body(b'{"rs": "success", "token": {"value": "SECRETTOKEN"}}', "application/json")
+    assert "SECRETTOKEN" not in content["text"]
+    assert json.loads(content["text"])["rs"] == "success"
+
+
+def test_html_links_and_hidden_fields_are_redacted():
+    html = (
+        '<a href="index.iphp?sess_id=abcdef123456&amp;subaction=show">x</a>'
+        '<input type="hidden" name="sess_id" value="abcdef123456"/>'
+    )
+    content = redact_body(html.encode(), "text/html; charset=utf-8")
+    assert "abcdef123456" not in content["text"]
+    assert "subaction=show" in content["text"]
+
+
+def test_multipart_secret_parts_are_redacted():
+    request = requests.Request(
+        "POST", "https://api.ocr.space/parse/image",
+        data={"apikey": "MYAPIKEY", "language": "eng"},
+        files={"file": ("captcha", b"\x89PNG image", "application/octet-stream")},
+    ).prepare()
+    content = redact_body(request.body, request.headers["Content-Type"])
+    body = http_trace.decode_content(content)
+    assert b"MYAPIKEY" not in body
+    assert b"\x89PNG image" in body and b"eng" in body
+
+
+def test_form_and_url_redaction_keep_other_fields():
+    assert "hunter2" not in redact_form("email=a%40x&password=hunter2")
+    assert "a%40x" in redact_form("email=a%40x&password=hunter2")
+    url = redact_url("https://api.telegram.org/bot123:ABC/sendMessage")
+    assert "123:ABC" not in url
+    assert redact_text("pin=123456 rest") != "pin=123456 rest"
+
+
+class PageAdapter(BaseAdapter):
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "text/html"
+        response.raw = io.BytesIO(b"<div id='orders'>" + b"x" * 5000 + b"</div>")
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+def test_streamed_response_is_recorded_and_replayed(tmp_path):
+    recorder = TraceRecorder(str(tmp_path))
+    session = recorder.attach(requests.Session())
+    session.mount("https://", PageAdapter())
+    with session.get("https://support.euserv.com/index.iphp?sess_id=SESSIONVALUE", stream=True) as response:
+        read = b"".join(response.iter_content(chunk_size=1024))
+    recorder.close()
+    paths = sorted(str(p) for p in tmp_path.glob("trace-*.jsonl.gz"))
+    with gzip.open(paths[0], "rt", encoding="utf-8") as f:
+        entry = json.loads(f.readline())
+    assert "SESSIONVALUE" not in entry["request"]["url"]
+
+    replayed = replay_session(paths).get("https://support.euserv.com/index.iphp?sess_id=other", stream=True)
+    assert b"".join(replayed.iter_content(chunk_size=1024)) == read
+
+
+def test_log_text_in_form_fields_is_redacted():
+    form = redact_form("chat_id=1&text=%F0%9F%93%A7+%5BMailParser%5D+PIN%3A+123456")
+    assert "123456" not in form
+    assert "MailParser" in form
+
+
+class MailparserAdapter(BaseAdapter):
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json"
+        response.raw = io.BytesIO(json.dumps([{"pin": "123456", "receiver": "a@x.com"}]).encode())
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+def test_breaker_sessions_are_recorded_and_replayed(tmp_path, monkeypatch):
+    import euserv
+
+    recorder = TraceRecorder(str(tmp_path))
+    monkeypatch.setattr(http_trace, "_recorder", recorder)
+
+    def stand_in():
+        session = requests.Session()
+        session.mount("https://", MailparserAdapter())
+        return session
+
+    previous = euserv.set_session_factory(stand_in)
+    try:
+        _, recorded = euserv.fetch_mailparser_entries("DOWNLOADID")
+        recorder.close()
+        paths = sorted(str(p) for p in tmp_path.glob("trace-*.jsonl.gz"))
+        assert paths
+        monkeypatch.setattr(http_trace, "_recorder", None)
+        euserv.set_session_factory(lambda: replay_session(paths))
+        _, replayed = euserv.fetch_mailparser_entries("OTHERID")
+    finally:
+        euserv.set_session_factory(previous)
+    assert replayed[0]["receiver"] == recorded[0]["receiver"]
+    assert replayed[0]["pin"] != "123456"
@@ -0,0 +1,72 @@
+import sqlite3
+
+import requests
+
+import euserv
+
+
+def steal(store, username):
+    conn = sqlite3.connect(store.path)
+    with conn:
+        conn.execute("UPDATE leases SET owner = 'other' WHERE account = ?", (euserv.account_key(username),))
+    conn.close()
+
+
+def test_lost_lease_stops_before_the_pin_request(tmp_path, monkeypatch):
+    store = euserv.LeaseStore(str(tmp_path / "leases.db"), 120)
+    monkeypatch.setattr(euserv, "leases", store)
+    assert store.acquire("alice@example.com") is None
+    steal(store, "alice@example.com")
+
+    class NoPost(requests.Session):
+        def post(self, *args, **kwargs):
+            raise AssertionError("PIN must not be requested")
+
+    cp = euserv.RenewalCheckpoint(None, "100", "sess")
+    cp.receiver = "alice@example.com"
+    assert not euserv._renew_request_pin(cp, NoPost(), "")
+    assert euserv.account_key("alice@example.com") in store.lost
+    store.release("alice@example.com")
+
+
+def test_accounts_without_a_lease_are_always_held(tmp_path):
+    store = euserv.LeaseStore(str(tmp_path / "leases.db"), 120)
+    assert store.still_held("bob@example.com")
+
+
+def test_heartbeat_stops_with_the_last_lease(tmp_path):
+    store = euserv.LeaseStore(str(tmp_path / "leases.db"), 120)
+    store.acquire("alice@example.com")
+    store.acquire("bob@example.com")
+    stop = store._stop
+    store.release("alice@example.com")
+    assert not stop.is_set()
+    store.release("bob@example.com")
+    assert stop.is_set() and store._stop is None
+    store.acquire("alice@example.com")
+    assert store._stop is not None and store._stop is not stop
+    store.release("alice@example.com")
+
+
+def test_unwritable_state_dir_falls_back_to_no_lease(tmp_path, monkeypatch):
+    (tmp_path / "file").write_text("")
+    store = euserv.LeaseStore(str(tmp_path / "file" / "leases.db"), 120)
+    monkeypatch.setattr(euserv, "leases", store)
+    monkeypatch.setattr(euserv, "ACCOUNT_LEASE", "skip")
+    assert euserv.acquire_lease(0, "alice@example.com")
+    euserv.release_lease("alice@example.com")
+    assert not store.held
+
+
+def test_release_failure_is_logged(tmp_path, monkeypatch):
+    store = euserv.LeaseStore(str(tmp_path / "leases.db"), 120)
+    monkeypatch.setattr(euserv, "leases", store)
+    monkeypatch.setattr(euserv, "ACCOUNT_LEASE", "skip")
+    assert euserv.acquire_lease(0, "alice@example.com")
+
+    def locked():
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(store, "_connect", locked)
+    euserv.release_lease("alice@example.com")
+    assert "賬號租約釋放失敗" in euserv.desp
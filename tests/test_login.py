@@ -0,0 +1,20 @@
+import pytest
+
+import euserv
+
+
+@pytest.mark.parametrize("page, rejected", [
+    ('<form><input name="password"/></form><p>Please check email address/customer ID and password.</p>', True),
+    ('<form><input name="password"/></form>', False),
+    ('<form><input name="password"/></form>Too many login attempts, please try again later.', False),
+    ("To finish the login process please solve the following captcha.", False),
+    ("Hello XYZ", False),
+])
+def test_login_rejected_only_on_wrong_password_message(page, rejected):
+    assert euserv.login_rejected(page) is rejected
+
+
+def test_login_checks():
+    assert euserv.login_succeeded("<div>Hello XYZ</div>")
+    assert euserv.captcha_required("To finish the login process please solve the following captcha.")
+    assert not euserv.captcha_required("Hello XYZ")
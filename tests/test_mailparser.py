@@ -0,0 +1,48 @@
+import euserv
+
+SINCE = 1790000000.0
+
+
+def entry(pin, receiver, received_at="2026-09-21T14:15:00Z"):
+    mail = {"pin": pin, "receiver": receiver}
+    if received_at:
+        mail["received_at"] = received_at
+    return mail
+
+
+def test_receiver_must_match_exactly():
+    entries = [entry("222", "aa@x.com"), entry("111", "EUserv Customer <A@x.com>")]
+    assert euserv._mailparser_match(entries, "a@x.com", SINCE, shared=True) == "111"
+    assert euserv._mailparser_match(entries[:1], "a@x.com", SINCE, shared=True) is None
+
+
+def test_entries_without_time_or_before_request_are_ignored():
+    entries = [entry("333", "a@x.com", received_at=None), entry("444", "a@x.com", "2026-09-01T00:00:00Z")]
+    assert euserv._mailparser_match(entries, "a@x.com", SINCE, shared=True) is None
+
+
+def test_newest_matching_pin_wins():
+    entries = [entry("555", "a@x.com", "2026-09-21T14:20:00Z"), entry("444", "a@x.com", "2026-09-21T14:16:00Z")]
+    assert euserv._mailparser_match(entries, "a@x.com", SINCE, shared=True) == "555"
+
+
+def test_own_inbox_takes_latest_entry():
+    assert euserv._mailparser_match([entry("666", "someone@else.com", None)], None, SINCE, shared=False) == "666"
+
+
+def test_second_order_does_not_get_the_previous_pin(monkeypatch):
+    previous = euserv.set_clock(euserv.SimulatedClock(epoch=SINCE))
+    try:
+        monkeypatch.setattr(euserv, "_mailparser_consumed", {})
+        monkeypatch.setattr(euserv, "_mailparser_cache", {})
+        monkeypatch.setattr(euserv, "shared_inboxes", {"inbox"})
+        first = entry("111", "a@x.com", "2026-09-21T14:15:00Z")
+        second = entry("222", "a@x.com", "2026-09-21T14:16:00Z")
+        responses = iter([[first], [first], [second, first]])
+        monkeypatch.setattr(euserv, "fetch_mailparser_entries",
+                            lambda url_id: (euserv.clock.time(), next(responses)))
+        assert euserv.get_pin_from_mailparser("inbox", "a@x.com", SINCE) == "111"
+        # 第二個訂單 45 秒後申請 PIN，第一封郵件仍在時鐘偏差的容忍範圍內，但已經用過
+        assert euserv.get_pin_from_mailparser("inbox", "a@x.com", SINCE + 45) == "222"
+    finally:
+        euserv.set_clock(previous)
@@ -0,0 +1,73 @@
+"""子進程和守護進程兩種 OCR 工作方式；加載真實的 ddddocr 模型，需要幾秒鐘"""
+
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import euserv
+
+pytest.importorskip("ddddocr")
+
+from test_captcha_preprocess import captcha_png
+
+
+class StillAlive:
+    """is_alive() 仍返回 True 的已退出進程，模擬空閒退出與請求之間的競爭"""
+
+    def __init__(self, process):
+        self.process = process
+
+    def is_alive(self):
+        return True
+
+    def kill(self):
+        self.process.kill()
+
+
+def test_process_worker_restarts_after_an_idle_exit():
+    client = euserv.OcrProcessClient()
+    try:
+        assert client.recognize(captcha_png())
+        client._process.kill()
+        client._process.join()
+        client._process = StillAlive(client._process)
+        assert client.recognize(captcha_png())
+        assert client._process.is_alive() and not isinstance(client._process, StillAlive)
+    finally:
+        if client._process is not None:
+            client._process.kill()
+
+
+def test_daemon_serves_requests_and_exits_when_idle(tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "ocr.sock")
+    monkeypatch.setattr(euserv, "OCR_WORKER_IDLE_TIMEOUT", 1)
+    daemon = threading.Thread(target=euserv.run_ocr_daemon, args=(socket_path,), daemon=True)
+    daemon.start()
+    started = time.monotonic()
+    while not os.path.exists(socket_path):
+        assert time.monotonic() - started < 60
+        time.sleep(0.1)
+
+    client = euserv.OcrDaemonClient(socket_path)
+    connect = client.connect
+    calls = []
+
+    def flaky_connect():
+        # 第一次連接到一個立即關閉的對端，模擬守護進程在連接之後退出
+        calls.append(1)
+        if len(calls) == 1:
+            ours, theirs = socket.socketpair()
+            theirs.close()
+            return ours
+        return connect()
+
+    monkeypatch.setattr(client, "connect", flaky_connect)
+    assert client.recognize(captcha_png())
+    assert len(calls) == 2
+
+    daemon.join(timeout=10)
+    assert not daemon.is_alive()
+    assert not os.path.exists(socket_path)
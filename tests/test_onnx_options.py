@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+import euserv
+
+onnxruntime = pytest.importorskip("onnxruntime")
+
+
+def test_intra_op_threads_split_the_cpu_budget(monkeypatch):
+    monkeypatch.setattr(euserv, "OCR_CPU_BUDGET", 8)
+    monkeypatch.setattr(euserv, "OCR_INTRA_OP_THREADS", 0)
+    assert euserv.ocr_intra_op_threads(2) == 4
+    assert euserv.ocr_intra_op_threads(16) == 1
+    monkeypatch.setattr(euserv, "OCR_INTRA_OP_THREADS", 3)
+    assert euserv.ocr_intra_op_threads(2) == 3
+
+
+def test_session_options():
+    options = euserv.ocr_session_options(intra_op_threads=2, inter_op_threads=1, optimization="basic")
+    assert options.intra_op_num_threads == 2
+    assert options.inter_op_num_threads == 1
+    assert options.graph_optimization_level == onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC
+    with pytest.raises(ValueError):
+        euserv.ocr_session_options(optimization="fast")
+
+
+def test_create_ddddocr_only_tunes_its_own_sessions(monkeypatch):
+    import ddddocr
+
+    created = []
+
+    def fake_session(model, options=None, *args, **kwargs):
+        created.append((model, options))
+        return object()
+
+    class FakeOcr:
+        def __init__(self, show_ad=False):
+            onnxruntime.InferenceSession("ocr.onnx")
+            # 其他線程（如預熱或推測識別）同時創建的會話不受影響
+            other = threading.Thread(target=onnxruntime.InferenceSession, args=("custom.onnx",))
+            other.start()
+            other.join()
+
+    monkeypatch.setattr(onnxruntime, "InferenceSession", fake_session)
+    monkeypatch.setattr(ddddocr, "DdddOcr", FakeOcr)
+    monkeypatch.setattr(euserv, "quantized_model_path", lambda path: "int8-" + path)
+
+    euserv.create_ddddocr(intra_op_threads=1)
+
+    (ocr_model, ocr_options), (custom_model, custom_options) = created
+    assert ocr_model == "int8-ocr.onnx" and ocr_options.intra_op_num_threads == 1
+    assert custom_model == "custom.onnx" and custom_options is None
+    assert onnxruntime.InferenceSession is fake_session
@@ -0,0 +1,35 @@
+import euserv
+
+PAGE = (
+    '<html><body><div id="kc2_order_customer_orders_tab_content_1">'
+    '<table class="kc2_order_table kc2_content_table">'
+    '<tr><td class="td-z1-sp1-kc">100</td><td class="td-z1-sp2-kc">VS2-free<br/>'
+    '<div class="kc2_order_action_container">'
+    '<input type="submit" name="Submit" value="Extend contract"/></div></td>'
+    '<td>Contract end: 2030-02-01</td></tr>'
+    '<tr><td class="td-z1-sp1-kc">200</td><td class="td-z1-sp2-kc">VS2-free &amp; more<br/>'
+    '<div class="kc2_order_action_container">Contract extension possible from 05.03.2030</div></td></tr>'
+    '</table></div>'
+    '<div id="footer"><td class="td-z1-sp1-kc">999</td></div>'
+    '</body></html>'
+)
+
+
+def test_parse_orders_reads_status_and_dates():
+    orders = euserv.parse_orders(PAGE)
+    assert set(orders) == {"100", "200"}
+    first, second = orders["100"], orders["200"]
+    assert first.renewable and first.status == "Extend contract"
+    assert first.product == "VS2-free"
+    assert first.contract_end == euserv.date(2030, 2, 1)
+    assert not second.renewable
+    assert second.product == "VS2-free & more"
+    assert second.extension_possible_from == euserv.date(2030, 3, 5)
+
+
+def test_extractor_stops_at_the_end_of_the_orders_container():
+    extractor = euserv.OrdersTableExtractor()
+    extractor.feed(PAGE)
+    assert extractor.done
+    assert "footer" not in extractor.fragment
+    assert euserv.parse_orders(extractor.fragment) == euserv.parse_orders(PAGE)
\ No newline at end of file
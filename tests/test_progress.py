@@ -0,0 +1,29 @@
+import requests
+
+import euserv
+
+
+class FailingTelegram(requests.Session):
+    def request(self, method, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 429
+        response._content = b'{"ok": false}'
+        return response
+
+
+def test_progress_edit_failures_do_not_open_the_report_breaker(monkeypatch):
+    monkeypatch.setattr(euserv, "TG_BOT_TOKEN", "token")
+    monkeypatch.setattr(euserv, "TG_USER_ID", "1")
+    progress_breaker = euserv.CircuitBreaker("Telegram progress")
+    report_breaker = euserv.CircuitBreaker("Telegram")
+    progress_breaker._session = FailingTelegram()
+    monkeypatch.setitem(euserv.BREAKERS, "Telegram progress", progress_breaker)
+    monkeypatch.setitem(euserv.BREAKERS, "Telegram", report_breaker)
+
+    reporter = euserv.ProgressReporter()
+    reporter.message_id = 1
+    for i in range(10):
+        reporter._edit(f"progress {i}")
+
+    assert progress_breaker.state == progress_breaker.OPEN
+    assert report_breaker.state == report_breaker.CLOSED
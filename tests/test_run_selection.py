@@ -0,0 +1,60 @@
+from datetime import date, timedelta
+
+import pytest
+
+import euserv
+
+
+def order(order_id, renewable=False, contract_end=None, extension_possible_from=None):
+    return euserv.Order(order_id, "VS2-free", "", contract_end, extension_possible_from, renewable)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("30m", timedelta(minutes=30)),
+    ("12h", timedelta(hours=12)),
+    ("3d", timedelta(days=3)),
+    ("1w", timedelta(weeks=1)),
+    ("2", timedelta(days=2)),
+])
+def test_parse_duration(text, expected):
+    assert euserv.parse_duration(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "d", "-1d", "3y"])
+def test_parse_duration_rejects_invalid(text):
+    with pytest.raises(ValueError):
+        euserv.parse_duration(text)
+
+
+def test_only_failed_selects_failed_accounts_and_orders(tmp_path):
+    history = euserv.RunHistory(str(tmp_path / "last_run.json"))
+    history.record("ok@example.com", "ok", {"1": order("1")}, {"1": True})
+    history.record("partial@example.com", "failed", {"2": order("2"), "3": order("3")}, {"2": True, "3": False})
+    selection = euserv.RunSelection(only_failed=True, history=history)
+
+    assert not selection.select_account(0, "ok@example.com")
+    assert selection.select_account(1, "partial@example.com")
+    assert not selection.select_account(2, "new@example.com")
+    assert not selection.select_order("partial@example.com", order("2"))
+    assert selection.select_order("partial@example.com", order("3"))
+
+
+def test_history_is_reloaded_from_disk(tmp_path):
+    path = str(tmp_path / "last_run.json")
+    euserv.RunHistory(path).record("a@example.com", "ok", {"1": order("1", contract_end=date(2026, 12, 1))})
+    record = euserv.RunHistory(path).get("a@example.com")
+    assert record["orders"]["1"]["contract_end"] == "2026-12-01"
+
+
+def test_unreadable_order_page_is_recorded_as_failed(tmp_path, monkeypatch):
+    history = euserv.RunHistory(str(tmp_path / "last_run.json"))
+    monkeypatch.setattr(euserv, "STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(euserv, "warm_sessions", {})
+    monkeypatch.setattr(euserv, "login", lambda username, password: ("sessid", None))
+    monkeypatch.setattr(euserv, "get_orders", lambda *args, **kwargs: {})
+    monkeypatch.setattr(euserv, "check", lambda *args: None)
+    monkeypatch.setattr(euserv, "wait", lambda seconds: None)
+
+    euserv.renew_account(0, "a@example.com", "pw", "inbox", euserv.RunSelection(history=history))
+
+    assert history.get("a@example.com")["status"] == "failed"
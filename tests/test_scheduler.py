@@ -0,0 +1,70 @@
+from datetime import date
+
+import euserv
+
+TODAY = date(2026, 10, 19)
+
+
+def order(order_id, renewable=False, contract_end=None, extension_possible_from=None):
+    return euserv.Order(order_id, "VS2-free", "", contract_end, extension_possible_from, renewable)
+
+
+def test_order_need_by():
+    need_by = euserv._order_need_by
+    assert need_by({"renewable": True, "contract_end": "2026-10-25"}, TODAY) == date(2026, 10, 25)
+    assert need_by({"renewable": True}, TODAY) == TODAY
+    assert need_by({"renewable": False, "extension_possible_from": "2026-11-01"}, TODAY) is None
+    assert need_by({"renewable": False, "extension_possible_from": "2026-10-15",
+                    "contract_end": "2026-10-20"}, TODAY) == date(2026, 10, 20)
+    assert need_by({"status": "failed", "contract_end": "2026-10-21"}, TODAY) == date(2026, 10, 21)
+
+
+def test_renewed_order_is_no_longer_urgent(tmp_path):
+    history = euserv.RunHistory(str(tmp_path / "last_run.json"))
+    history.record("a@example.com", "ok",
+                   {"1": order("1", True, date(2026, 10, 20), date(2026, 10, 15))}, {"1": True})
+    record = history.get("a@example.com")["orders"]["1"]
+    assert euserv._order_need_by(record, TODAY) is None
+
+
+def test_scheduler_orders_by_urgency_and_defers_safe_accounts(tmp_path, monkeypatch):
+    monkeypatch.setattr(euserv, "STATE_DIR", str(tmp_path))
+    history = euserv.RunHistory(str(tmp_path / "last_run.json"))
+    history.record("far@example.com", "ok", {"1": order("1", True, date(2026, 12, 1))})
+    history.record("soon@example.com", "ok", {"2": order("2", True, date(2026, 10, 20))})
+    history.record("later@example.com", "ok", {"3": order("3", False, date(2026, 12, 1), date(2026, 11, 1))})
+    history.record_duration("soon@example.com", 100)
+    history.record_duration("soon@example.com", 200)
+    accounts = [(name, "", "") for name in
+                ("far@example.com", "later@example.com", "soon@example.com", "new@example.com")]
+    scheduler = euserv.RenewalScheduler(history)
+    scheduler.today = TODAY
+
+    ordered = [accounts[i][0] for i in scheduler.order(accounts, range(len(accounts)))]
+    assert ordered == ["new@example.com", "soon@example.com", "far@example.com", "later@example.com"]
+    assert scheduler.expected_duration("soon@example.com") == 130
+
+    previous = euserv.set_clock(euserv.SimulatedClock())
+    try:
+        short = euserv.Deadline(50)
+        assert scheduler.can_defer("far@example.com", short)
+        assert scheduler.can_defer("later@example.com", short)
+        assert not scheduler.can_defer("soon@example.com", short)
+        assert not scheduler.can_defer("new@example.com", short)
+        assert not scheduler.can_defer("far@example.com", euserv.Deadline(0))
+    finally:
+        euserv.set_clock(previous)
+
+
+def test_only_runs_that_reached_the_orders_record_a_duration(tmp_path, monkeypatch):
+    history = euserv.RunHistory(str(tmp_path / "last_run.json"))
+    accounts = [("failed@example.com", "pw", "inbox"), ("renewed@example.com", "pw", "inbox")]
+    monkeypatch.setattr(euserv, "PREFLIGHT", False)
+    monkeypatch.setattr(euserv, "ACCOUNT_LEASE", "off")
+    monkeypatch.setattr(euserv, "TG_BOT_TOKEN", "")
+    monkeypatch.setattr(euserv, "renew_account", lambda i, username, *args: username.startswith("renewed"))
+
+    euserv.run_accounts(accounts, euserv.RunSelection(history=history))
+
+    assert history.get("failed@example.com") is None
+    assert "duration" in history.get("renewed@example.com")
@@ -0,0 +1,146 @@
+"""兩個賬號共用一個 mailparser 收件箱的完整續期流程：本地替身代替 EUserv 和 mailparser，
+模擬時鐘代替真實等待，真實運行時間在一秒左右"""
+
+import io
+import json
+import time
+import itertools
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+import euserv
+
+ACCOUNTS = {"alice@example.com": ("100", "101"), "bob@example.com": ("200",)}
+
+
+class StandIn(BaseAdapter):
+    """按 sess_id 區分賬號的最小 EUserv 控制面板，以及按收件人投遞 PIN 的共用收件箱"""
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+        self.sessions = {}
+        self.renewed = set()
+        self.mails = []
+        self.pending_pin = {}
+        self._ids = itertools.count(1)
+
+    def _orders_page(self, account: str) -> str:
+        rows = "".join(
+            f'<tr><td class="td-z1-sp1-kc">{order}</td><td class="td-z1-sp2-kc">VS2-free<br/>'
+            f'<div class="kc2_order_action_container">'
+            + ("Contract extension possible from 2030-01-01" if order in self.renewed
+               else '<input type="submit" name="Submit" value="Extend contract"/>')
+            + "</div></td></tr>"
+            for order in ACCOUNTS[account]
+        )
+        return (
+            f'<html><body><div id="kc2_navigation">Hello</div><div id="{euserv.ORDERS_CONTAINER_ID}">'
+            f'<table class="kc2_order_table kc2_content_table">{rows}</table></div></body></html>'
+        )
+
+    def _handle(self, request, response) -> str:
+        url = urlsplit(request.url)
+        if url.netloc == "files.mailparser.io":
+            return json.dumps([
+                {"pin": pin, "receiver": f"EUserv <{to}>",
+                 "received_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(sent))}
+                for pin, to, sent in reversed(self.mails)
+            ])
+        if request.method == "GET":
+            sess_id = parse_qs(url.query).get("sess_id", [""])[0]
+            if sess_id in self.sessions:
+                return self._orders_page(self.sessions[sess_id])
+            response.headers["Set-Cookie"] = f"PHPSESSID=standin{next(self._ids):08d}; path=/"
+            return "<html>login</html>"
+        body = {k: v[0] for k, v in parse_qs(request.body or "").items()}
+        account = self.sessions.get(body.get("sess_id"))
+        action = body.get("subaction")
+        if action == "login":
+            if body.get("email") not in ACCOUNTS:
+                return '<form><input name="password"/></form>Please check email address/customer ID and password.'
+            self.sessions[body["sess_id"]] = body["email"]
+            return "Hello"
+        if action == "show_kc2_security_password_dialog":
+            pin = f"{len(self.mails) + 100000}"
+            self.pending_pin[account] = pin
+            self.mails.append((pin, account, self.clock.time()))
+            return "ok"
+        if action == "kc2_security_password_get_token":
+            if self.pending_pin.get(account) != body.get("auth"):
+                return json.dumps({"rs": "error"})
+            return json.dumps({"rs": "success", "token": {"value": f"token-{account}"}})
+        if action == "kc2_customer_contract_details_extend_contract_term":
+            assert body["token"] == f"token-{account}"
+            self.renewed.add(body["ord_id"])
+        return "ok"
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.request = request
+        response.url = request.url
+        response.raw = io.BytesIO(self._handle(request, response).encode("utf-8"))
+        response.encoding = "utf-8"
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def stand_in(tmp_path, monkeypatch):
+    sim = euserv.SimulatedClock(epoch=1790000000.0)
+    server = StandIn(sim)
+
+    def session_factory():
+        session = requests.Session()
+        session.mount("https://", server)
+        return session
+
+    previous_clock = euserv.set_clock(sim)
+    previous_factory = euserv.set_session_factory(session_factory)
+    monkeypatch.setattr(euserv, "STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(euserv, "USERNAME", " ".join(ACCOUNTS))
+    monkeypatch.setattr(euserv, "PASSWORD", "pw1 pw2")
+    monkeypatch.setattr(euserv, "MAILPARSER_DOWNLOAD_URL_ID", "inbox")
+    monkeypatch.setattr(euserv, "TG_BOT_TOKEN", "")
+    monkeypatch.setattr(euserv, "STARTUP_PREWARM", False)
+    monkeypatch.setattr(euserv, "CAPTCHA_SPECULATIVE", "off")
+    monkeypatch.setattr(euserv, "run_history", euserv.RunHistory(str(tmp_path / "last_run.json")))
+    monkeypatch.setattr(euserv, "leases", euserv.LeaseStore(str(tmp_path / "leases.db"), 120))
+    monkeypatch.setattr(euserv, "warm_sessions", {})
+    monkeypatch.setattr(euserv, "shared_inboxes", set())
+    monkeypatch.setattr(euserv, "_mailparser_cache", {})
+    monkeypatch.setattr(euserv, "_mailparser_consumed", {})
+    yield sim, server
+    euserv.set_clock(previous_clock)
+    euserv.set_session_factory(previous_factory)
+
+
+def test_two_accounts_renew_in_simulated_time(stand_in):
+    sim, server = stand_in
+    started = time.monotonic()
+    euserv.main_handler(None, None)
+    elapsed = time.monotonic() - started
+
+    assert server.renewed == {"100", "101", "200"}
+    # 三次 PIN 等待和各賬號的檢查等待都在模擬時鐘上完成
+    assert sim.monotonic() >= 3 * euserv.WAITING_TIME_OF_PIN
+    assert elapsed < 10
+    for username in ACCOUNTS:
+        record = euserv.run_history.get(username)
+        assert record["status"] == "ok"
+        assert all(order["status"] == "ok" for order in record["orders"].values())
+
+
+def test_unknown_account_is_excluded_by_preflight(stand_in, monkeypatch):
+    sim, server = stand_in
+    monkeypatch.setattr(euserv, "USERNAME", "alice@example.com mallory@example.com")
+    euserv.main_handler(None, None)
+
+    assert server.renewed == {"100", "101"}
+    assert euserv.run_history.get("mallory@example.com")["status"] == "bad_credentials"
@@ -0,0 +1,205 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+用登錄時收集的驗證碼樣本訓練 EUserv（securimage）專用的輕量識別模型
+* 樣本來自 CAPTCHA_HARVEST_DIR/passed/，文件名為 <通過驗證的答案>_<哈希>.png
+* 模型為小型 CRNN（卷積 + 雙向 GRU，CTC 損失），只在 CPU 上訓練和推理
+* 導出 ONNX 模型和同名 JSON（字符集、輸入尺寸），設置 CAPTCHA_MODEL_PATH 後作為 custom 引擎使用
+* 在驗證集上與 ddddocr 比較首次識別正確率和單張推理耗時，未同時勝出時以非零狀態退出
+
+訓練需要 PyTorch（pip install torch），運行 euserv.py 只需要 onnxruntime。
+
+用法:
+    CAPTCHA_HARVEST_DIR=.euserv_state/captchas python euserv.py   # 收集樣本
+    python train_captcha.py --samples .euserv_state/captchas --output captcha_model.onnx
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+from typing import List, Tuple
+
+import numpy as np
+
+import euserv
+
+INPUT_HEIGHT = 32
+INPUT_WIDTH = 128
+MIN_SAMPLES = 50
+
+def load_samples(directory: str) -> List[Tuple[np.ndarray, str, bytes, str]]:
+    """讀取 passed/ 中的樣本；只保留長度和字符都符合 securimage 設置的答案（算術驗證碼的答案不是圖中文字）"""
+    alphabet = set(euserv.CAPTCHA_ALPHABET.lower())
+    passed = os.path.join(directory, "passed")
+    samples = []
+    for name in sorted(os.listdir(passed)) if os.path.isdir(passed) else []:
+        label = name.rsplit("_", 1)[0].lower()
+        if len(label) != euserv.CAPTCHA_LENGTH or not set(label) <= alphabet:
+            continue
+        with open(os.path.join(passed, name), "rb") as f:
+            image = euserv.preprocess_captcha(f.read())
+        samples.append((euserv.captcha_model_input(image, INPUT_HEIGHT, INPUT_WIDTH)[0], label, image, name))
+    return samples
+
+def split_samples(samples: list, val_fraction: float) -> Tuple[list, list]:
+    """按文件名哈希劃分，新增樣本不會改變已有樣本的歸屬"""
+    train, val = [], []
+    for sample in samples:
+        bucket = int(hashlib.sha1(sample[3].encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+        (val if bucket < val_fraction else train).append(sample)
+    return train, val
+
+def build_model(torch, num_classes: int):
+    nn = torch.nn
+
+    def block(cin: int, cout: int, pool) -> list:
+        return [nn.Conv2d(cin, cout, 3, padding=1, bias=False), nn.BatchNorm2d(cout), nn.ReLU(inplace=True),
+                nn.MaxPool2d(pool)]
+
+    class CRNN(nn.Module):
+        def __init__(self):
+            super().__init__()
+            # 32x128 -> 2x32：高度方向壓縮到 2，寬度方向保留 32 個時間步
+            self.features = nn.Sequential(
+                *block(1, 32, 2), *block(32, 64, 2), *block(64, 96, (2, 1)), *block(96, 128, (2, 1))
+            )
+            self.rnn = nn.GRU(128 * 2, 96, bidirectional=True, batch_first=True)
+            self.classifier = nn.Linear(192, num_classes)
+
+        def forward(self, x):
+            features = self.features(x).permute(0, 3, 1, 2).flatten(2)  # (N, T, C * H)
+            output, _ = self.rnn(features)
+            return self.classifier(output)  # (N, T, 類別數)
+
+    return CRNN()
+
+def augment(torch, batch):
+    """隨機平移幾個像素並加少量噪聲，模擬 securimage 的位置抖動和干擾"""
+    shifted = torch.stack([
+        torch.roll(image, shifts=(random.randint(-2, 2), random.randint(-4, 4)), dims=(1, 2)) for image in batch
+    ])
+    return (shifted + 0.05 * torch.randn_like(shifted)).clamp(0, 1)
+
+def train(torch, samples: list, charset: List[str], args):
+    index = {char: i for i, char in enumerate(charset)}
+    model = build_model(torch, len(charset))
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=1e-4)
+    scheduler = torch.optim.lr_scheduler.OneCycleLR(
+        optimizer, max_lr=args.lr, total_steps=args.epochs * ((len(samples) + args.batch_size - 1) // args.batch_size)
+    )
+    ctc = torch.nn.CTCLoss(blank=0, zero_infinity=True)
+    images = torch.from_numpy(np.stack([s[0] for s in samples]))
+    targets = [torch.tensor([index[c] for c in s[1]]) for s in samples]
+    for epoch in range(args.epochs):
+        model.train()
+        order = torch.randperm(len(samples))
+        total = 0.0
+        for start in range(0, len(samples), args.batch_size):
+            batch = order[start:start + args.batch_size]
+            log_probs = model(augment(torch, images[batch])).log_softmax(-1).permute(1, 0, 2)  # (T, N, C)
+            target = [targets[i] for i in batch.tolist()]
+            loss = ctc(
+                log_probs,
+                torch.cat(target),
+                torch.full((len(batch),), log_probs.shape[0], dtype=torch.long),
+                torch.tensor([len(t) for t in target]),
+            )
+            optimizer.zero_grad()
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(model.parameters(), 5.0)
+            optimizer.step()
+            scheduler.step()
+            total += loss.item() * len(batch)
+        if (epoch + 1) % 10 == 0 or epoch == args.epochs - 1:
+            print(f"epoch {epoch + 1}/{args.epochs} loss {total / len(samples):.4f}")
+    return model
+
+def export(torch, model, charset: List[str], path: str):
+    """導出輸出 softmax 概率的 ONNX 模型，並在同名 JSON 中寫入字符集和輸入尺寸"""
+    class WithSoftmax(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, x):
+            return self.inner(x).softmax(-1)
+
+    model.eval()
+    torch.onnx.export(
+        WithSoftmax(model), torch.zeros(1, 1, INPUT_HEIGHT, INPUT_WIDTH), path,
+        input_names=["image"], output_names=["probabilities"],
+        dynamic_axes={"image": {0: "batch"}, "probabilities": {0: "batch"}}, opset_version=13,
+    )
+    with open(os.path.splitext(path)[0] + ".json", "w", encoding="utf-8") as f:
+        json.dump({"charset": charset, "height": INPUT_HEIGHT, "width": INPUT_WIDTH}, f, ensure_ascii=False)
+
+def evaluate(name: str, recognize, samples: list) -> dict:
+    """首次識別正確率（大小寫不敏感，與 securimage 默認一致）和單張推理耗時"""
+    correct, elapsed = 0, 0.0
+    for _, label, image, _ in samples:
+        started = time.perf_counter()
+        candidates = recognize(image)
+        elapsed += time.perf_counter() - started
+        correct += bool(candidates) and candidates[0][0].lower() == label
+    return {"engine": name, "pass_rate": correct / len(samples), "ms_per_image": elapsed / len(samples) * 1000}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="訓練 EUserv 驗證碼識別模型")
+    parser.add_argument("--samples", default=euserv.CAPTCHA_HARVEST_DIR or os.path.join(euserv.STATE_DIR, "captchas"),
+                        help="樣本目錄（CAPTCHA_HARVEST_DIR）")
+    parser.add_argument("--output", default="captcha_model.onnx", help="導出的 ONNX 模型路徑")
+    parser.add_argument("--epochs", type=int, default=60)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=3e-3)
+    parser.add_argument("--val-fraction", type=float, default=0.2, help="驗證集比例")
+    parser.add_argument("--threads", type=int, default=0, help="訓練使用的 CPU 線程數，0 為默認")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-compare", action="store_true", help="不與 ddddocr 比較")
+    args = parser.parse_args(argv)
+
+    try:
+        import torch
+    except ImportError:
+        print("訓練需要 PyTorch: pip install torch")
+        return 2
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    samples = load_samples(args.samples)
+    if len(samples) < MIN_SAMPLES:
+        print(f"可用樣本只有 {len(samples)} 個，至少需要 {MIN_SAMPLES} 個，請先設置 CAPTCHA_HARVEST_DIR 收集")
+        return 2
+    train_set, val_set = split_samples(samples, args.val_fraction)
+    print(f"訓練樣本 {len(train_set)} 個，驗證樣本 {len(val_set)} 個")
+    charset = [""] + sorted(set(euserv.CAPTCHA_ALPHABET.lower()))
+    model = train(torch, train_set, charset, args)
+    export(torch, model, charset, args.output)
+    print(f"模型已導出: {args.output}")
+
+    if args.no_compare or not val_set:
+        return 0
+    custom = euserv.CaptchaModel(args.output)
+    results = [evaluate("custom", lambda image: custom.candidates(image, 1), val_set)]
+    try:
+        ocr = euserv.create_ddddocr()
+        results.append(evaluate("ddddocr", lambda image: euserv._ddddocr_candidates(ocr, image, 1), val_set))
+    except ImportError:
+        print("未安裝 ddddocr，跳過比較")
+    print(f"{'engine':<10} {'pass rate':>10} {'ms/image':>10}")
+    for result in results:
+        print(f"{result['engine']:<10} {result['pass_rate']:>10.1%} {result['ms_per_image']:>10.2f}")
+    if len(results) == 2 and not (
+        results[0]["pass_rate"] > results[1]["pass_rate"] and results[0]["ms_per_image"] < results[1]["ms_per_image"]
+    ):
+        print("自訓練模型沒有在正確率和速度上同時優於 ddddocr，請收集更多樣本後重新訓練")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())